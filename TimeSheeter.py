@@ -3,73 +3,668 @@ import re
 import calendar
 from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
-import pickle
-import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import pandas as pd
-from tabulate import tabulate
 import configparser
 import argparse
+import bisect
+import contextlib
+import csv
+import collections
+import hashlib
+import io
+import json
+import math
+import os
+import heapq
+import itertools
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 import logging
 from enum import Enum, auto
-import yaml
+from typing import TYPE_CHECKING
+import config_cache
+from event_store import EventStore, ROLLUP_DAY_SECONDS, rollup_day, utc_timestamp
+from calendar_service import SERVICE_POOL, EVENT_LIST_FIELDS
+from profiling import PROFILER, format_summary
+from invoicing import DEFAULT_TIMESHEET_COLUMNS, TIMESHEET_COLUMNS, invoice_context, timesheet_pdf_context
+import columnar_export
+
+# pandas and tabulate are imported where they are needed, so TOTAL and CSV output start without them
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# If modifying these scopes, delete the file token.pickle.
-SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+# Events are requested in pages of the maximum size the Calendar API allows. A background
+# thread prefetches at most EVENTS_PAGE_BUFFER pages ahead of the consumer (see Prefetcher).
+EVENTS_PAGE_SIZE = 2500
+EVENTS_PAGE_BUFFER = 2
+
+# Maximum number of calendars synced at the same time; fetched calendars are all read at once by the merge
+CALENDAR_FETCH_WORKERS = 8
+# Long ranges are fetched as separate time windows, at most this many ahead of the one being read per calendar
+WINDOW_FETCH_WORKERS = 8
+
+# Written next to the PDFs of a batch invoicing run, see TimesheetGenerator.generate_invoices
+INVOICE_MANIFEST = 'manifest.json'
+# Progress stages of TimesheetGenerator.render_invoices, as reported to a jobs.Job
+INVOICE_STAGES = ('fetch', 'process', 'render')
+
+# Seconds between polls for changed events in watch mode (--watch without a value)
+WATCH_INTERVAL = 60
+
+
+def empty_frame():
+    import pandas as pd
+    return pd.DataFrame()
 
 
 @dataclass
 class TimeSheetData:
     client_name: str
     total_duration: datetime.timedelta = field(default_factory=lambda: datetime.timedelta())
-    time_sheet_df: pd.DataFrame = field(default_factory=lambda: pd.DataFrame())
+    time_sheet_df: 'pd.DataFrame' = field(default_factory=empty_frame)
+    # Header and rows of the time sheet when it was built without pandas (time_sheet_df is None then)
+    rows: list = None
 
 
 class OutputFormat(Enum):
     TABLE = "table"
     CSV = "csv"
     TOTAL = "total"
+    CSV_STREAM = "csv-stream"
+    JSONL = "jsonl"
+    PARQUET = "parquet"
+    ARROW = "arrow"
 
     def __str__(self):
         return self.value
 
+    @property
+    def streaming(self):
+        """Whether rows are written as events arrive (see SheetStreamWriter) instead of per client sheet."""
+        return self in (OutputFormat.CSV_STREAM, OutputFormat.JSONL)
+
+    @property
+    def columnar(self):
+        """Whether all sheets are written to a file with native types (see columnar_export) instead of printed."""
+        return self in (OutputFormat.PARQUET, OutputFormat.ARROW)
+
+
+def parse_timestamp(value):
+    """Parse a Calendar API RFC 3339 timestamp or plain date, falling back to dateutil for oddities."""
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return parse(value)
+
+
+@dataclass(slots=True)
+class CalendarEvent:
+    """The parts of a Calendar API event the time sheets use.
+
+    Events are converted when they are fetched; the rest of the API resource (creator, attendees,
+    links, ...) is dropped right away instead of being carried through the pipeline.
+    """
+    id: str
+    start: datetime.datetime
+    end: datetime.datetime
+    summary: str = ''
+    all_day: bool = False
+
+    @classmethod
+    def from_api(cls, event):
+        start = event['start']
+        end = event['end']
+        return cls(event['id'],
+                   parse_timestamp(start.get('dateTime', start.get('date'))),
+                   parse_timestamp(end.get('dateTime', end.get('date'))),
+                   event.get('summary', ''),
+                   'dateTime' not in start)
+
+
+class Prefetcher:
+    """Reads iterables on background threads, each at most buffer_size items ahead of its consumer.
+
+    add() starts reading an iterable right away and returns a generator of its items. At most
+    `ahead` iterables are read or waiting to be consumed at a time; the next one added starts once
+    one of them has been consumed to the end, so with more of them they must be consumed in the
+    order they were added. Leaving the with block stops the readers and waits for them, including
+    for a request in progress, so a (not thread-safe) service they use can be handed out again.
+    """
+
+    _DONE = object()
+
+    def __init__(self, ahead=1, buffer_size=EVENTS_PAGE_BUFFER):
+        self.ahead = ahead
+        self.buffer_size = buffer_size
+        self.stop = threading.Event()
+        self.pending = collections.deque()
+        self.active = 0
+        self.threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+    def add(self, iterable):
+        items = queue.Queue(maxsize=self.buffer_size)
+        self.pending.append((iterable, items))
+        self._start()
+        return self._read(items)
+
+    def _start(self):
+        while self.pending and self.active < self.ahead and not self.stop.is_set():
+            iterable, items = self.pending.popleft()
+            self.active += 1
+            thread = threading.Thread(target=self._produce, args=(iterable, items), name="gcal-prefetch", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _read(self, items):
+        try:
+            while True:
+                item = items.get()
+                if item is self._DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.active -= 1
+            self._start()
+
+    def _produce(self, iterable, items):
+        try:
+            for item in iterable:
+                if not self._put(items, item):
+                    return
+        except Exception as e:
+            self._put(items, e)
+            return
+        finally:
+            # Lets a generator release what it holds (such as a service) on this thread
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+        self._put(items, self._DONE)
+
+    def _put(self, items, item):
+        while not self.stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+def format_hhmm(durations):
+    """Format a Series of timedeltas as HH:MM strings; hours keep counting past 24."""
+    seconds = durations.dt.total_seconds()
+    hours = (seconds // 3600).astype('int64').astype(str).str.zfill(2)
+    minutes = ((seconds // 60) % 60).astype('int64').astype(str).str.zfill(2)
+    return hours + ':' + minutes
+
+
+def format_duration_hhmm(duration):
+    """Format one timedelta as HH:MM, like format_hhmm does for a Series."""
+    seconds = duration.total_seconds()
+    return f"{int(seconds // 3600):02d}:{int((seconds // 60) % 60):02d}"
+
+
+class TagRouter:
+    """Routes event summaries to clients by their @tags.
+
+    A tag belongs to the first client (shortest name first) whose alias_tag from clients.yaml, or
+    its name when there is none, contains the tag text: @fake matches "Faker Client". Each distinct
+    tag is resolved once, so routing costs one regex scan per event however many clients there are.
+    aliases is the lower-cased alias per client name, as precomputed in ClientConfig.aliases.
+    """
+
+    # A word starting with @, plus the separators after it that are removed along with the tag
+    TAG_PATTERN = re.compile(r'(?<!\S)@(\S+)[^\w@]*')
+    TRAILING_PUNCTUATION = re.compile(r'\W+$')
+
+    def __init__(self, aliases, client_list):
+        self.aliases = [(client, aliases.get(client, str(client).lower())) for client in sorted(client_list, key=len)]
+        self.tag_clients = {}
+
+    def resolve(self, tag):
+        """Return the client name for a tag such as '@acme', or None when no client matches."""
+        if tag not in self.tag_clients:
+            name = tag[1:].lower()
+            self.tag_clients[tag] = next((client for client, alias in self.aliases if name and name in alias), None)
+        return self.tag_clients[tag]
+
+    def route(self, summary):
+        """Return {client name: summary with that client's tags removed} for each client tagged in summary."""
+        client_spans = {}
+        for match in self.TAG_PATTERN.finditer(summary):
+            tag = '@' + self.TRAILING_PUNCTUATION.sub('', match.group(1))
+            client = self.resolve(tag)
+            if client is not None:
+                client_spans.setdefault(client, []).append(match.span())
+        return {client: self.remove_spans(summary, spans) for client, spans in client_spans.items()}
+
+    @staticmethod
+    def remove_spans(summary, spans):
+        parts = []
+        position = 0
+        for start, end in spans:
+            parts.append(summary[position:start])
+            position = end
+        parts.append(summary[position:])
+        return ''.join(parts).strip()
+
+    def fingerprint(self):
+        """Return a short hash of the client aliases, which together decide where every tag is routed."""
+        return hashlib.sha1(json.dumps(self.aliases).encode('utf-8')).hexdigest()[:16]
+
+    def get_client_tags(self):
+        """Return {client name: [tags]} for the tags matched so far."""
+        client_tags = {}
+        for tag, client in self.tag_clients.items():
+            if client is not None:
+                client_tags.setdefault(client, []).append(tag)
+        return client_tags
+
+
+class TimeSheetBuilder:
+    """Collects the parsed events of one client column by column and builds the time sheet once."""
+
+    # Columns of a time sheet after TimesheetGenerator.add_totals_to_sheet
+    COLUMNS = ['Date', 'Day_total', 'Day', 'Start_time', 'End_time', 'Duration', 'Week_nr', 'Week_total',
+               'Week_duration', 'Description']
 
-class TimesheetGenerator:
     def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.durations = []
+        self.descriptions = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start_parsed, end_parsed, duration_event, event_summary):
+        self.starts.append(start_parsed)
+        self.ends.append(end_parsed)
+        self.durations.append(duration_event)
+        self.descriptions.append(event_summary)
+
+    def extend(self, starts, ends, durations, descriptions):
+        self.starts.extend(starts)
+        self.ends.extend(ends)
+        self.durations.extend(durations)
+        self.descriptions.extend(descriptions)
+
+    def build(self):
+        import pandas as pd
+        duration = pd.Series(self.durations)
+        week_nr = pd.Series([start.strftime("%V") for start in self.starts])
+        # The running week duration restarts whenever the ISO week changes from one event to the next
+        week_run = (week_nr != week_nr.shift()).cumsum()
+        week_duration = duration.groupby(week_run).cumsum()
+        return pd.DataFrame({
+            'Date': [start.strftime("%d-%m-%Y") for start in self.starts],
+            'Day': [start.strftime("%d") for start in self.starts],
+            'Start_time': [start.strftime("%H:%M") for start in self.starts],
+            'End_time': [end.strftime("%H:%M") for end in self.ends],
+            'Duration': duration,  # Store as timedelta object
+            'Week_nr': week_nr,
+            'Week_duration': format_hhmm(week_duration),
+            'Description': self.descriptions,
+        })
+
+    def totals(self, run_starts=()):
+        """Return the Week_nr and Day per row, the running week durations, {(Week_nr, Day): total} and {Week_nr: total}.
+
+        The running week duration restarts when the Week_nr changes, and at the row indexes in
+        run_starts (for rows that follow rows left out of the builder, see IncrementalSheets).
+        """
+        week_nrs = [start.strftime("%V") for start in self.starts]
+        days = [start.strftime("%d") for start in self.starts]
+
+        week_durations = []
+        day_totals = {}
+        last_week_durations = {}
+        previous_week_nr = running = None
+        for index, (week_nr, day, duration) in enumerate(zip(week_nrs, days, self.durations)):
+            running = duration if week_nr != previous_week_nr or index in run_starts else running + duration
+            previous_week_nr = week_nr
+            week_durations.append(running)
+            day_totals[week_nr, day] = day_totals.get((week_nr, day), datetime.timedelta()) + duration
+            last_week_durations[week_nr] = running
+        return week_nrs, days, week_durations, day_totals, last_week_durations
+
+    def rows(self, week_totals=False, run_starts=()):
+        """Return the rows (lists of strings, in COLUMNS order) that build() and add_totals_to_sheet produce, without pandas."""
+        week_nrs, days, week_durations, day_totals, last_week_durations = self.totals(run_starts)
+        return [[start.strftime("%d-%m-%Y"),
+                 format_duration_hhmm(day_totals[week_nr, day]),
+                 day,
+                 start.strftime("%H:%M"),
+                 end.strftime("%H:%M"),
+                 format_duration_hhmm(duration),
+                 week_nr,
+                 format_duration_hhmm(last_week_durations[week_nr]) if week_totals else '',
+                 format_duration_hhmm(week_duration),
+                 description]
+                for start, end, duration, week_nr, day, week_duration, description
+                in zip(self.starts, self.ends, self.durations, week_nrs, days, week_durations, self.descriptions)]
+
+    def columns(self, week_totals=False):
+        """Return the same time sheet as {column: list} of dates, datetimes and timedeltas, for columnar_export."""
+        week_nrs, days, week_durations, day_totals, last_week_durations = self.totals()
+        return {
+            'Date': [start.date() for start in self.starts],
+            'Day_total': [day_totals[key] for key in zip(week_nrs, days)],
+            'Start_time': self.starts,
+            'End_time': self.ends,
+            'Duration': self.durations,
+            'Week_nr': week_nrs,
+            'Week_total': [last_week_durations[week_nr] if week_totals else None for week_nr in week_nrs],
+            'Week_duration': week_durations,
+            'Description': self.descriptions,
+        }
+
+
+@dataclass
+class ClientInvoice:
+    """The invoice PDF of one client, as rendered by TimesheetGenerator.render_invoices."""
+    client_name: str
+    timesheet: TimeSheetData
+    totals: 'ClientTotals'
+    path: str
+    # The path the PDF was written to, or the exception rendering it raised
+    result: object = None
+
+    @property
+    def error(self):
+        return self.result if isinstance(self.result, Exception) else None
+
+
+@dataclass
+class ClientTotals:
+    """Durations of one client's tagged events per day (the date of the event start), without the events."""
+    client_name: str
+    days: dict = field(default_factory=dict)
+
+    @property
+    def total_duration(self):
+        return sum(self.days.values(), datetime.timedelta())
+
+    @property
+    def first_day(self):
+        return min(self.days)
+
+    @property
+    def last_day(self):
+        return max(self.days)
+
+    def week_range(self):
+        """Return the lowest and highest Week_nr of the client's time sheet rows."""
+        week_nrs = [day.strftime("%V") for day in self.days]
+        return min(week_nrs), max(week_nrs)
+
+    def week_totals(self):
+        """Return {(ISO year, ISO week): duration}."""
+        totals = {}
+        for day, duration in self.days.items():
+            week = day.isocalendar()[:2]
+            totals[week] = totals.get(week, datetime.timedelta()) + duration
+        return totals
+
+    def month_totals(self):
+        """Return {(year, month): duration}."""
+        totals = {}
+        for day, duration in self.days.items():
+            totals[day.year, day.month] = totals.get((day.year, day.month), datetime.timedelta()) + duration
+        return totals
+
+
+class SheetStreamWriter:
+    """Writes time sheet rows of all clients, one per tagged event, as soon as the event arrives.
+
+    Only a running week duration per client is kept, so memory does not grow with the report.
+    Totals that need the whole day or week (Day_total, Week_total) are therefore not included;
+    a Client column tells the interleaved clients apart. Rows are written as CSV or as JSON lines.
+    """
+
+    COLUMNS = ['Client', 'Date', 'Day', 'Start_time', 'End_time', 'Duration', 'Week_nr', 'Week_duration',
+               'Description']
+
+    def __init__(self, file, json_lines=False):
+        self.file = file
+        self.json_lines = json_lines
+        self.row_count = 0
+        # client name -> (ISO week number, duration so far in that week)
+        self.week_durations = {}
+        self.csv_writer = None
+        if not json_lines:
+            self.csv_writer = csv.writer(file, lineterminator='\n')
+            self.csv_writer.writerow(self.COLUMNS)
+
+    def write(self, client_name, start, end, description):
+        duration = end - start
+        week_nr = start.strftime("%V")
+        previous_week_nr, week_duration = self.week_durations.get(client_name, (None, None))
+        week_duration = duration if week_nr != previous_week_nr else week_duration + duration
+        self.week_durations[client_name] = (week_nr, week_duration)
+
+        row = [client_name, start.strftime("%d-%m-%Y"), start.strftime("%d"), start.strftime("%H:%M"),
+               end.strftime("%H:%M"), format_duration_hhmm(duration), week_nr,
+               format_duration_hhmm(week_duration), description]
+        if self.json_lines:
+            self.file.write(json.dumps(dict(zip(self.COLUMNS, row)), ensure_ascii=False) + '\n')
+        else:
+            self.csv_writer.writerow(row)
+        self.row_count += 1
+
+    def flush(self):
+        self.file.flush()
+
+
+class IncrementalSheets:
+    """Time sheets of a date range that are patched from changed events instead of being rebuilt.
+
+    The rows of each client are kept in slices per Week_nr, the ISO week number of the event start
+    without its year, as the time sheets total per Week_nr: in a range of several years, a slice holds
+    the same week of each year. Day_total and Week_total never cross a slice and the running
+    Week_duration only continues from the client's previous row when that row has the same Week_nr,
+    so a changed event only rebuilds the slices it left and joined, and the slice of the next row
+    when its run starts or ends there. Applying a change costs in proportion to the events of those
+    weeks, not to the whole range. As in TimesheetGenerator.merge_event_streams, an event is
+    identified by its ID and start, so one held by several calendars is a single row, showing the
+    version of the first calendar that holds it.
+    """
+
+    def __init__(self, router, start_date, end_date, week_totals=False):
+        self.router = router
+        self.start_ts = utc_timestamp(start_date)
+        self.end_ts = utc_timestamp(end_date)
+        self.week_totals = week_totals
+        # (calendar index, event ID) -> (event ID, start_ts) of that calendar's version, for events in range
+        self.calendar_events = {}
+        # (event ID, start_ts) -> {calendar index: CalendarEvent}
+        self.versions = {}
+        # (event ID, start_ts) -> (sort key, CalendarEvent, {client: description}) of the tagged events shown
+        self.events = {}
+        # client -> sorted sort keys (start_ts, event ID) of its events, the order of its rows
+        self.client_order = {}
+        # (client, Week_nr) -> event keys, sort keys and rows (COLUMNS order) in row order, and total duration
+        self.slice_events = {}
+        self.slice_order = {}
+        self.slice_rows = {}
+        self.slice_totals = {}
+
+    def apply(self, cal_index, items):
+        """Apply changed API events (cancelled ones included) of one calendar and return the set of slice keys they changed."""
+        touched = set()
+        for item in items:
+            old_key = self.calendar_events.pop((cal_index, item['id']), None)
+            if old_key is not None:
+                versions = self.versions[old_key]
+                del versions[cal_index]
+                if not versions:
+                    del self.versions[old_key]
+                touched.add(old_key)
+            if item.get('status') != 'cancelled' and 'start' in item:
+                event = CalendarEvent.from_api(item)
+                start_ts = utc_timestamp(event.start)
+                if start_ts < self.end_ts and utc_timestamp(event.end) > self.start_ts:
+                    key = (event.id, start_ts)
+                    self.calendar_events[cal_index, event.id] = key
+                    self.versions.setdefault(key, {})[cal_index] = event
+                    touched.add(key)
+
+        changed = set()
+        for key in touched:
+            changed.update(self._remove(key))
+            versions = self.versions.get(key)
+            if versions:
+                changed.update(self._add(key, versions[min(versions)]))
+        for slice_key in changed:
+            self._rebuild(slice_key)
+        return changed
+
+    def _week_nr(self, sort_key):
+        return self.events[sort_key[1], sort_key[0]][1].start.strftime("%V")
+
+    def _next_run_slice(self, client, position, week_nr):
+        """Return the slice of the row at position when its run changes as a row of week_nr comes or goes before it.
+
+        That row continues the run of the row before it when both have the same Week_nr.
+        """
+        order = self.client_order[client]
+        if 0 < position < len(order):
+            next_week_nr = self._week_nr(order[position])
+            if next_week_nr != week_nr and next_week_nr == self._week_nr(order[position - 1]):
+                return [(client, next_week_nr)]
+        return []
+
+    def _add(self, key, event):
+        client_descriptions = self.router.route(event.summary)
+        if not client_descriptions:
+            return []
+        sort_key = (key[1], key[0])
+        self.events[key] = (sort_key, event, client_descriptions)
+        week_nr = event.start.strftime("%V")
+        slice_keys = []
+        for client in client_descriptions:
+            order = self.client_order.setdefault(client, [])
+            position = bisect.bisect_left(order, sort_key)
+            slice_keys += self._next_run_slice(client, position, week_nr)
+            order.insert(position, sort_key)
+            slice_keys.append((client, week_nr))
+            self.slice_events.setdefault((client, week_nr), set()).add(key)
+        return slice_keys
+
+    def _remove(self, key):
+        if key not in self.events:
+            return []
+        sort_key, event, client_descriptions = self.events[key]
+        week_nr = event.start.strftime("%V")
+        slice_keys = []
+        for client in client_descriptions:
+            order = self.client_order[client]
+            position = bisect.bisect_left(order, sort_key)
+            del order[position]
+            slice_keys += self._next_run_slice(client, position, week_nr)
+            if not order:
+                del self.client_order[client]
+            slice_keys.append((client, week_nr))
+            self.slice_events[client, week_nr].discard(key)
+        del self.events[key]
+        return slice_keys
+
+    def _rebuild(self, slice_key):
+        members = sorted((self.events[key] for key in self.slice_events.get(slice_key, ())), key=lambda member: member[0])
+        if not members:
+            for slices in (self.slice_events, self.slice_order, self.slice_rows, self.slice_totals):
+                slices.pop(slice_key, None)
+            return
+        client = slice_key[0]
+        order = self.client_order[client]
+        positions = [bisect.bisect_left(order, sort_key) for sort_key, _, _ in members]
+        # A row starts a new run unless the client's previous row is the previous row of the slice
+        run_starts = {index for index in range(1, len(members)) if positions[index] != positions[index - 1] + 1}
+        builder = TimeSheetBuilder()
+        for _, event, client_descriptions in members:
+            builder.add(event.start, event.end, event.end - event.start, client_descriptions[client])
+        self.slice_order[slice_key] = [sort_key for sort_key, _, _ in members]
+        self.slice_rows[slice_key] = builder.rows(self.week_totals, run_starts)
+        self.slice_totals[slice_key] = sum(builder.durations, datetime.timedelta())
+
+    def total_duration(self, client_name):
+        return sum((total for (client, _), total in self.slice_totals.items() if client == client_name),
+                   datetime.timedelta())
+
+    def sheets(self):
+        """Return a TimeSheetData with rows per client, clients in the order of their first event as elsewhere."""
+        client_slices = {}
+        for slice_key in self.slice_rows:
+            client_slices.setdefault(slice_key[0], []).append(slice_key)
+
+        def first_event(client):
+            # A client's first row, and its position among the clients of that event, as the event stream orders them
+            sort_key = self.client_order[client][0]
+            return sort_key, list(self.events[sort_key[1], sort_key[0]][2]).index(client)
+
+        return [TimeSheetData(client,
+                              sum((self.slice_totals[slice_key] for slice_key in slice_keys), datetime.timedelta()),
+                              time_sheet_df=None,
+                              rows=[row for _, row in heapq.merge(
+                                  *(zip(self.slice_order[slice_key], self.slice_rows[slice_key])
+                                    for slice_key in slice_keys))])
+                for client, slice_keys in sorted(client_slices.items(), key=lambda item: first_event(item[0]))]
+
+
+class TimesheetGenerator:
+    def __init__(self, offline=False, use_event_store=True, service_pool=None, window_days=None):
         self.now = datetime.datetime.utcnow()
         self.last_day_last_month = self.now.replace(day=1, hour=23, minute=59, second=59) - datetime.timedelta(days=1)
         self.first_day_last_month = self.last_day_last_month.replace(day=1, hour=0, minute=0, second=0)
         self.first_day_this_month = self.now.replace(day=1, hour=0, minute=0, second=0)
         self.last_day_this_month = (self.first_day_this_month + relativedelta(months=1)) - datetime.timedelta(days=1)
 
+        # Both files are parsed once per change and shared, see config_cache
         self.config = self.load_config()
-        self.yaml_data = self.load_yaml()
-        self.client_list = list(self.yaml_data['Clients'].keys())
+        self.client_config = self.load_yaml()
+        self.yaml_data = self.client_config.data
+        self.client_list = list(self.client_config.client_list)
+        self.output_format = OutputFormat.TABLE
+
+        # Calendar services and credentials are shared process-wide unless a pool is injected
+        self.service_pool = service_pool or SERVICE_POOL
+        # Size of the windows a long API fetch is split into: None = calendar months, 0 = no splitting
+        self.window_days = window_days
+
+        # offline: build timesheets purely from the local event store, without contacting Google
+        self.offline = offline
+        self.event_store = None
+        if use_event_store:
+            self.event_store = EventStore(self.config.get('Event Store', 'Path', fallback='events.db'))
+        elif offline:
+            raise ValueError("Offline mode requires the local event store")
 
     def load_config(self):
-        config = configparser.ConfigParser()
-        config.read('config.ini')
-        return config
+        return config_cache.load_config('config.ini')
     
     def load_yaml(self):
-        try:
-            with open('clients.yaml', 'r') as file:
-                return yaml.safe_load(file)
-        except Exception as e:
-            logging.error("Error reading clients.yaml: %s", str(e))
-            raise
+        return config_cache.load_clients('clients.yaml')
 
     def list_calendars(self):
-        creds = self.get_credentials()
-        service = build('calendar', 'v3', credentials=creds)
-
-        calendar_list = service.calendarList().list().execute()
+        with self.service_pool.service() as service:
+            calendar_list = service.calendarList().list().execute()
         calendars = calendar_list.get('items', [])
 
         if not calendars:
@@ -94,154 +689,321 @@ class TimesheetGenerator:
             raise
 
     def get_credentials(self):
-        from google.auth.exceptions import RefreshError
-        creds = None
-        if os.path.exists('token.pickle'):
-            try:
-                with open('token.pickle', 'rb') as token:
-                    creds = pickle.load(token)
-            except Exception as e:
-                logging.warning(f"Failed to load token.pickle: {e}")
-                creds = None
-                
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                except RefreshError:
-                    logging.warning("Refresh token expired or invalid. Restarting auth process.")
-                    flow = InstalledAppFlow.from_client_secrets_file('client_secrets.json', SCOPES)
-                    creds = flow.run_local_server(port=0)
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file('client_secrets.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(creds, token)
-        return creds
+        return self.service_pool.get_credentials()
+
+    def get_calendar_ids(self):
+        """Return the calendar IDs listed (comma or newline separated) under CalID in config.ini."""
+        value = self.config.get('Google Calendar', 'CalID', fallback='')
+        cal_ids = [cal_id for cal_id in re.split(r'[,\s]+', value) if cal_id]
+        if not cal_ids:
+            raise ValueError("CalID must be provided in the config.ini file")
+        return cal_ids
 
     def get_gcal_events(self, start_date, end_date, time_zone='GMT+01:00'):
-        creds = self.get_credentials()
-        service = build('calendar', 'v3', credentials=creds)
+        """Yield the events (CalendarEvent) of all configured calendars between start_date and end_date, ordered by start time.
 
-        cal_id = self.config.get('Google Calendar', 'CalID', fallback=None)
-        if not cal_id:
-            raise ValueError("CalID must be provided in the config.ini file")
+        With the event store enabled each calendar is first brought up to date with an incremental
+        sync (skipped when offline) and events are then read from disk. Otherwise they are
+        fetched from the API, following nextPageToken. Several calendars are synced or fetched
+        concurrently and their events merged into one stream; fetched calendars are merged as their
+        pages arrive, each on its own Prefetcher, as the merge needs the next event of every one.
+        """
+        cal_ids = self.get_calendar_ids()
+
+        if len(cal_ids) == 1:
+            # A single calendar is streamed page by page as it arrives
+            if self.event_store is None:
+                with Prefetcher(WINDOW_FETCH_WORKERS) as prefetcher:
+                    yield from self.fetch_calendar_events(prefetcher, cal_ids[0], start_date, end_date, time_zone)
+            else:
+                if not self.offline:
+                    self.sync_calendar(cal_ids[0], time_zone)
+                yield from self.read_stored_events(cal_ids[0], start_date, end_date)
+            return
+
+        logging.info("Getting events of %d calendars", len(cal_ids))
+        if self.event_store is None:
+            with contextlib.ExitStack() as stack:
+                streams = [self.fetch_calendar_events(stack.enter_context(Prefetcher(WINDOW_FETCH_WORKERS)),
+                                                      cal_id, start_date, end_date, time_zone)
+                           for cal_id in cal_ids]
+                yield from self.merge_event_streams(streams)
+            return
+
+        if not self.offline:
+            with ThreadPoolExecutor(max_workers=min(len(cal_ids), CALENDAR_FETCH_WORKERS)) as executor:
+                list(executor.map(lambda cal_id: self.sync_calendar(cal_id, time_zone), cal_ids))
+        streams = [self.read_stored_events(cal_id, start_date, end_date) for cal_id in cal_ids]
+        yield from self.merge_event_streams(streams)
+
+    def sync_calendar(self, cal_id, time_zone, changes=None):
+        with self.service_pool.service() as service:
+            self.event_store.sync(service, cal_id, time_zone, changes)
+
+    def read_stored_events(self, cal_id, start_date, end_date):
+        if self.offline and not self.event_store.has_calendar(cal_id):
+            raise ValueError(f"Calendar {cal_id} is not in the local event store yet, run once without --offline")
+        logging.info("Reading stored events of %s between %s and %s", cal_id, start_date, end_date)
+        return map(CalendarEvent.from_api, self.event_store.get_events(cal_id, start_date, end_date))
+
+    def fetch_calendar_events(self, prefetcher, cal_id, start_date, end_date, time_zone):
+        """Start fetching the events of one calendar from the API on prefetcher and return an iterator of them, ordered by start time.
+
+        Ranges spanning several windows (see split_range) are fetched as one request stream per
+        window. The windows are read in turn while up to prefetcher.ahead of them are fetched in
+        parallel, so events are yielded as soon as the first page arrives and memory is bounded by
+        the windows ahead, not by the whole range.
+        """
+        windows = self.split_range(start_date, end_date, self.window_days)
+        if len(windows) > 1:
+            logging.info("Fetching %s in %d windows", cal_id, len(windows))
+        streams = [prefetcher.add(self.fetch_window_pages(cal_id, window_start, window_end, time_zone))
+                   for window_start, window_end in windows]
+        return self.chain_windows(windows, streams)
 
+    @staticmethod
+    def chain_windows(windows, streams):
+        """Yield the events of the pages of consecutive windows in start time order, each event once.
+
+        An event overlapping a window boundary comes back from each window it overlaps; only the
+        window its start falls in yields it. The first window also yields the events starting
+        before the range, the last one those starting after it.
+        """
+        if len(windows) == 1:
+            for page in streams[0]:
+                yield from page
+            return
+        for index, ((window_start, window_end), pages) in enumerate(zip(windows, streams)):
+            low = utc_timestamp(window_start) if index > 0 else -math.inf
+            high = utc_timestamp(window_end) if index < len(windows) - 1 else math.inf
+            for page in pages:
+                yield from (event for event in page if low <= utc_timestamp(event.start) < high)
+
+    @staticmethod
+    def split_range(start_date, end_date, window_days=None):
+        """Split start_date..end_date into consecutive (start, end) windows.
+
+        Windows end at the start of each calendar month, or every window_days days when given;
+        window_days=0 returns the whole range as one window.
+        """
+        if window_days == 0:
+            return [(start_date, end_date)]
+        windows = []
+        window_start = start_date
+        while window_start < end_date:
+            if window_days is None:
+                window_end = window_start.replace(day=1, hour=0, minute=0, second=0, microsecond=0) + relativedelta(months=1)
+            else:
+                window_end = window_start + datetime.timedelta(days=window_days)
+            window_end = min(window_end, end_date)
+            windows.append((window_start, window_end))
+            window_start = window_end
+        return windows or [(start_date, end_date)]
+
+    def fetch_window_pages(self, cal_id, start_date, end_date, time_zone):
+        """Yield the events of one calendar and time window from the API, a list per page."""
         start_date = start_date.isoformat() + 'Z'
         end_date = end_date.isoformat() + 'Z'
 
-        logging.info("Getting gcal events between %s and %s", start_date, end_date)
+        logging.info("Getting gcal events of %s between %s and %s", cal_id, start_date, end_date)
 
-        events_result = service.events().list(calendarId=cal_id, timeMin=start_date, timeMax=end_date,
-                                              maxResults=1000, singleEvents=True,
-                                              orderBy='startTime', timeZone=time_zone).execute()
-        return events_result.get('items', [])
+        with self.service_pool.service() as service:
+            page_token = None
+            while True:
+                page = service.events().list(calendarId=cal_id, timeMin=start_date, timeMax=end_date,
+                                             maxResults=EVENTS_PAGE_SIZE, singleEvents=True,
+                                             orderBy='startTime', timeZone=time_zone,
+                                             fields=EVENT_LIST_FIELDS, pageToken=page_token).execute()
+                yield list(map(CalendarEvent.from_api, page.get('items', [])))
+                page_token = page.get('nextPageToken')
+                if not page_token:
+                    return
 
     @staticmethod
-    def get_strlist_of_tags(input_list, tag="@"):
-        out_list = []
-        for input_str in input_list:
-            out_list.extend([word for word in input_str.split() if word.lower().startswith(tag)])
-        return list(set(out_list))
-
-    def get_client_tag_dict(self, tag_list, client_list):
-        client_list.sort(key=len)
-        out_dct = {}
-        for tag in tag_list:
-            for client in client_list:
-                alias = self.yaml_data['Clients'].get(client, {}).get('alias_tag', client)
-                if tag[1:].lower() in alias.lower():
-                    if tag not in out_dct:
-                        out_dct[tag] = client
-                    break
-        return out_dct
-
-    def get_client_name_dict(self, tag_list, client_list):
-        client_tag_dict = self.get_client_tag_dict(tag_list, client_list)
-        return {v: [k for k, val in client_tag_dict.items() if val == v] for v in client_tag_dict.values()}
+    def merge_event_streams(streams):
+        """Merge event streams that are each ordered by start time into one ordered stream.
+
+        An event present in several streams (same event ID and start) is yielded once. The API only
+        orders by start time, so events starting at the same time may come in any order; the IDs
+        already yielded for the current start time are remembered instead of just the last one.
+        """
+        def keyed(stream_index, stream):
+            for event in stream:
+                yield utc_timestamp(event.start), event.id, stream_index, event
+
+        current_ts = None
+        seen_ids = set()
+        for start_ts, event_id, _, event in heapq.merge(*(keyed(i, stream) for i, stream in enumerate(streams))):
+            if start_ts != current_ts:
+                current_ts = start_ts
+                seen_ids.clear()
+            if event_id not in seen_ids:
+                seen_ids.add(event_id)
+                yield event
+
+    def client_totals(self, start_date, end_date, selected_clients=None, time_zone='GMT+01:00', sync=True,
+                      events=None):
+        """Return the ClientTotals of the clients with tagged events between start_date and end_date.
+
+        The clients come in the order their time sheets would. With the event store, the whole UTC
+        days of the range are read from the store's rollup index; days missing from it are computed
+        once from the stored events and saved. Only the events starting on the partial days at the
+        ends of the range are routed on every call. Like in get_gcal_events, an event in several
+        calendars (same ID and start) is counted once. sync=False skips the incremental sync, for
+        callers that have just synced. Without the store the events are fetched and summed, or
+        events (already fetched for the range) are summed when given.
+        """
+        router = TagRouter(self.client_config.aliases, selected_clients if selected_clients else self.client_list)
+        # client -> [sort key of its first event, {day: seconds}]
+        totals = {}
+
+        def add(client, day, seconds, first):
+            entry = totals.setdefault(client, [first, {}])
+            entry[0] = min(entry[0], first)
+            entry[1][day] = entry[1].get(day, 0.0) + seconds
+
+        def add_events(events):
+            for start_ts, event_id, event in events:
+                for rank, client in enumerate(router.route(event.summary)):
+                    add(client, event.start.date(), (event.end - event.start).total_seconds(),
+                        (start_ts, event_id, rank))
+
+        if self.event_store is None or events is not None:
+            # Events are numbered in stream order, which is the order the time sheets list clients in
+            if events is None:
+                events = self.get_gcal_events(start_date, end_date, time_zone)
+            add_events((index, '', event) for index, event in enumerate(events))
+        else:
+            cal_ids = self.get_calendar_ids()
+            if sync and not self.offline:
+                with ThreadPoolExecutor(max_workers=min(len(cal_ids), CALENDAR_FETCH_WORKERS)) as executor:
+                    list(executor.map(lambda cal_id: self.sync_calendar(cal_id, time_zone), cal_ids))
+
+            start_ts, end_ts = utc_timestamp(start_date), utc_timestamp(end_date)
+            first_day = -int(-start_ts // ROLLUP_DAY_SECONDS)
+            end_day = max(rollup_day(end_ts), first_day)
+            if self.offline:
+                for cal_id in cal_ids:
+                    if not self.event_store.has_calendar(cal_id):
+                        raise ValueError(f"Calendar {cal_id} is not in the local event store yet, run once without --offline")
+            for _, client, local_day, seconds, _, *first in self.rollup(cal_ids, router, first_day, end_day):
+                add(client, datetime.date.fromisoformat(local_day), seconds, tuple(first))
+
+            edge_streams = []
+            for cal_id in cal_ids:
+                if first_day == end_day:
+                    edges = self.event_store.get_events(cal_id, start_date, end_date)
+                else:
+                    # Events overlapping the start of the range, then those starting after its last whole day
+                    edges = itertools.chain(
+                        self.event_store.get_events(cal_id, start_date,
+                                                    datetime.datetime.fromtimestamp(first_day * ROLLUP_DAY_SECONDS,
+                                                                                    datetime.timezone.utc)),
+                        (event for _, _, event in self.event_store.get_events_starting(
+                            cal_id, end_day * ROLLUP_DAY_SECONDS, end_ts)))
+                edge_streams.append(map(CalendarEvent.from_api, edges))
+            add_events((utc_timestamp(event.start), event.id, event) for event in self.merge_event_streams(edge_streams))
+
+        return [ClientTotals(client, {day: datetime.timedelta(seconds=seconds) for day, seconds in sorted(days.items())})
+                for client, (_, days) in sorted(totals.items(), key=lambda item: item[1][0])]
+
+    def rollup(self, cal_ids, router, first_day, end_day):
+        """Return the rollup rows of days [first_day, end_day), computing the days not in the index.
+
+        The rollup covers the calendars together, so an event in several of them (same ID and start) is
+        counted once, as in the merged event stream.
+        """
+        store = self.event_store
+        rollup_id = ','.join(cal_ids)
+        routing = router.fingerprint()
+        # One write transaction, so no sync, through this store or another one on the same database
+        # (such as another web app job's), can change events between reading them and saving their rollup
+        with store.transaction():
+            missing = store.missing_rollup_days(rollup_id, routing, first_day, end_day)
+            # Consecutive missing days are read with one query per calendar
+            for _, run in itertools.groupby(enumerate(missing), key=lambda item: item[1] - item[0]):
+                days = [day for _, day in run]
+                # (start_ts, event ID) -> event, the version of the first calendar holding it
+                events = {}
+                for cal_id in cal_ids:
+                    for start_ts, event_id, data in store.get_events_starting(
+                            cal_id, days[0] * ROLLUP_DAY_SECONDS, (days[-1] + 1) * ROLLUP_DAY_SECONDS):
+                        events.setdefault((start_ts, event_id), data)
+                rows = {}
+                # In start order, so the first event of each row is the one set when the row is created
+                for (start_ts, event_id), data in sorted(events.items(), key=lambda item: item[0]):
+                    event = CalendarEvent.from_api(data)
+                    for rank, client in enumerate(router.route(event.summary)):
+                        key = (rollup_day(start_ts), client, event.start.date().isoformat())
+                        row = rows.setdefault(key, [0.0, 0, start_ts, event_id, rank])
+                        row[0] += (event.end - event.start).total_seconds()
+                        row[1] += 1
+                store.put_rollup(rollup_id, routing, days, [key + tuple(row) for key, row in rows.items()])
+            return store.get_rollup(rollup_id, routing, first_day, end_day)
+
+    def route_events(self, events, client_list):
+        """Route events to clients by their @tags, returning ({client: [(event, description)]}, router)."""
+        # A single pass over the (possibly streaming) events routes each one to its client buckets
+        router = TagRouter(self.client_config.aliases, client_list)
+        client_events = {}
+        for event in events:
+            for client_name, description in router.route(event.summary).items():
+                client_events.setdefault(client_name, []).append((event, description))
+        return client_events, router
 
     def process_events(self, events, client_list):
-        event_summary_list = [event['summary'] for event in events]
-        tag_list = self.get_strlist_of_tags(event_summary_list, "@")
-        client_name_tag_dict = self.get_client_name_dict(tag_list, client_list)
+        with PROFILER.span('tag_matching') as span:
+            client_events, router = self.route_events(events, client_list)
+            span.count = sum(len(cl_events) for cl_events in client_events.values())
 
         if self.output_format == OutputFormat.TABLE:
-            logging.info("The following @tag client name matches were made: %s", str(client_name_tag_dict))
+            logging.info("The following @tag client name matches were made: %s", str(router.get_client_tags()))
             print(
                 "If you don't want a certain tag/client to be included, remove the client from client.ini file or add # in front of the client name.")
 
         time_tables = []
-        for cl_name, cl_tags in client_name_tag_dict.items():
-            time_table = self.process_client_events(events, cl_name, cl_tags)
-            if not time_table.time_sheet_df.empty:
-                time_tables.append(time_table)
+        with PROFILER.span('dataframes') as span:
+            for cl_name, cl_events in client_events.items():
+                time_table = self.process_client_events(cl_events, cl_name)
+                if not time_table.time_sheet_df.empty:
+                    time_tables.append(time_table)
+            span.count = sum(len(time_table.time_sheet_df) for time_table in time_tables)
 
         return time_tables
 
-    def process_client_events(self, events, client_name, client_tags):
+    def process_client_events(self, client_events, client_name):
+        """Build the time sheet of one client from its routed (event, description) pairs."""
         time_table = TimeSheetData(client_name)
-        previous_week = 0
-        week_dur = datetime.timedelta()
-
-        for event in events:
-            event_summary = event['summary']
-            if any(tag.lower() in event_summary.lower() for tag in client_tags):
-                if time_table.time_sheet_df.empty and self.output_format == OutputFormat.TABLE:
-                    logging.info("Generating time sheet for client: %s", client_name)
-
-                event_summary = self.clean_event_summary(event_summary, client_tags)
-                start_parsed, end_parsed, duration_event = self.parse_event_times(event)
+        builder = TimeSheetBuilder()
 
-                week_nr, week_dur = self.update_week_duration(start_parsed, duration_event, previous_week, week_dur)
-                previous_week = int(week_nr)
+        if self.output_format == OutputFormat.TABLE:
+            logging.info("Generating time sheet for client: %s", client_name)
 
-                row = self.create_event_row(start_parsed, end_parsed, duration_event, week_nr, week_dur, event_summary)
-                #time_table.time_sheet_df = time_table.time_sheet_df.append(row, ignore_index=True) deprecated
-                time_table.time_sheet_df = pd.concat([time_table.time_sheet_df, row], ignore_index=True)
-                time_table.total_duration += duration_event
+        events = [event for event, _ in client_events]
+        starts, ends, durations = self.event_times_batch(events)
+        builder.extend(starts, ends, durations, [description for _, description in client_events])
+        time_table.total_duration = sum(durations, time_table.total_duration)
 
+        if builder:
+            time_table.time_sheet_df = builder.build()
         return time_table
 
     @staticmethod
-    def clean_event_summary(summary, tags):
-        for tag in tags:
-            summary = re.sub(rf"{tag}\W+", "", summary, flags=re.I).strip()
-            summary = re.sub(rf"{tag}\w+", "", summary, flags=re.I).strip()
-        return summary
-
-    @staticmethod
-    def parse_event_times(event):
-        start = event['start'].get('dateTime', event['start'].get('date'))
-        end = event['end'].get('dateTime', event['end'].get('date'))
-        start_parsed = parse(start)
-        end_parsed = parse(end)
-        duration_event = end_parsed - start_parsed
-        return start_parsed, end_parsed, duration_event
+    def event_times(event):
+        return event.start, event.end, event.end - event.start
 
     @staticmethod
-    def update_week_duration(start_parsed, duration_event, previous_week, week_dur):
-        week_nr = start_parsed.strftime("%V")
-        if int(week_nr) != previous_week:
-            week_dur = datetime.timedelta()
-        week_dur += duration_event
-        return week_nr, week_dur
-
-    @staticmethod
-    def create_event_row(start_parsed, end_parsed, duration_event, week_nr, week_dur, event_summary):
-        duration_str = f"{duration_event.total_seconds() // 3600:02.0f}:{(duration_event.total_seconds() // 60) % 60:02.0f}"
-        week_dur_str = f"{week_dur.total_seconds() // 3600:02.0f}:{(week_dur.total_seconds() // 60) % 60:02.0f}"
-        return pd.DataFrame({
-            'Date': [start_parsed.strftime("%d-%m-%Y")],
-            'Day': [start_parsed.strftime("%d")],
-            'Start_time': [start_parsed.strftime("%H:%M")],
-            'End_time': [end_parsed.strftime("%H:%M")],
-            'Duration': [duration_event],  # Store as timedelta object
-            'Week_nr': [week_nr],
-            'Week_duration': [week_dur_str],
-            'Description': [event_summary]
-        })
+    def event_times_batch(events):
+        """Return the starts, ends and durations of a list of events as three lists."""
+        starts = [event.start for event in events]
+        ends = [event.end for event in events]
+        durations = [end - start for start, end in zip(starts, ends)]
+        return starts, ends, durations
 
     def generate_timesheet(self, start_date, end_date, week_totals=False, output_format: OutputFormat = OutputFormat.TABLE, selected_clients=None):
+        if output_format.streaming:
+            self.stream_timesheet(start_date, end_date, output_format, selected_clients)
+            return []
         self.output_format = output_format
         
         # Set logging level based on output format
@@ -250,53 +1012,360 @@ class TimesheetGenerator:
         else:  # TABLE format
             logging.getLogger().setLevel(logging.INFO)
         
+        if PROFILER.enabled and not self.offline:
+            with PROFILER.span('auth'):
+                self.get_credentials()
+
+        if output_format == OutputFormat.TOTAL and self.event_store is not None:
+            # Totals are answered from the event store's rollup index, without reading every event
+            with PROFILER.span('rollup') as span:
+                time_sheets = [TimeSheetData(totals.client_name, totals.total_duration, time_sheet_df=None)
+                               for totals in self.client_totals(start_date, end_date, selected_clients)]
+                span.count = len(time_sheets)
+            with PROFILER.span('output', count=len(time_sheets)):
+                for sheet in time_sheets:
+                    self.print_sheet_summary(sheet, output_format)
+            return time_sheets
+
         events = self.get_gcal_events(start_date, end_date)
-        if not events:
+        if PROFILER.enabled:
+            # Fetch everything first, so the stages consuming the stream are not charged for the API calls
+            with PROFILER.span('fetch') as span:
+                events = list(events)
+                span.count = len(events)
+            events = iter(events)
+        first_event = next(events, None)
+        if first_event is None:
             logging.info("No events found between %s and %s", start_date, end_date)
             return []
 
+        events = itertools.chain([first_event], events)
+        if output_format in (OutputFormat.TOTAL, OutputFormat.CSV):
+            time_sheets = self.build_plain_timesheets(events, week_totals, selected_clients,
+                                                      with_rows=output_format == OutputFormat.CSV)
+        else:
+            time_sheets = self.build_timesheets(events, week_totals, selected_clients)
+
+        with PROFILER.span('output', count=len(time_sheets)):
+            for sheet in time_sheets:
+                self.print_sheet_summary(sheet, output_format)
+
+        return time_sheets
+
+    def stream_timesheet(self, start_date, end_date, output_format: OutputFormat = OutputFormat.CSV_STREAM,
+                         selected_clients=None, file=None):
+        """Write the rows of all clients' time sheets to file (stdout by default) while events are fetched."""
+        self.output_format = output_format
+        logging.getLogger().setLevel(logging.WARNING)
+        return self.write_stream(self.get_gcal_events(start_date, end_date), output_format, selected_clients,
+                                 file or sys.stdout)
+
+    def write_stream(self, events, output_format, selected_clients, file):
+        """Route, parse and write events one at a time; return the number of rows written."""
+        router = TagRouter(self.client_config.aliases, selected_clients if selected_clients else self.client_list)
+        writer = SheetStreamWriter(file, json_lines=output_format == OutputFormat.JSONL)
+        with PROFILER.span('stream') as span:
+            for event in events:
+                client_descriptions = router.route(event.summary)
+                if not client_descriptions:
+                    continue
+                start, end, _ = self.event_times(event)
+                for client_name, description in client_descriptions.items():
+                    writer.write(client_name, start, end, description)
+                # Consumers see each row as soon as its event is processed
+                writer.flush()
+            span.count = writer.row_count
+        return writer.row_count
+
+    def export_timesheet(self, start_date, end_date, path, output_format: OutputFormat = OutputFormat.PARQUET,
+                         week_totals=False, selected_clients=None, partition=False):
+        """Write all clients' time sheets to path as Parquet or Arrow (see columnar_export); return the row count."""
+        self.output_format = output_format
+        logging.getLogger().setLevel(logging.WARNING)
+        client_list = selected_clients if selected_clients else self.client_list
+        with PROFILER.span('tag_matching') as span:
+            client_events, _ = self.route_events(self.get_gcal_events(start_date, end_date), client_list)
+            span.count = sum(len(cl_events) for cl_events in client_events.values())
+
+        client_columns = {}
+        with PROFILER.span('columns') as span:
+            for client_name, cl_events in client_events.items():
+                builder = TimeSheetBuilder()
+                starts, ends, durations = self.event_times_batch([event for event, _ in cl_events])
+                builder.extend(starts, ends, durations, [description for _, description in cl_events])
+                client_columns[client_name] = builder.columns(week_totals)
+            table = columnar_export.timesheets_table(client_columns)
+            span.count = table.num_rows
+
+        with PROFILER.span('output', count=table.num_rows):
+            columnar_export.write_table(table, path, output_format.value, partition)
+        return table.num_rows
+
+    def watch_timesheet(self, start_date, end_date, week_totals=False, selected_clients=None,
+                        interval=WATCH_INTERVAL, time_zone='GMT+01:00', polls=None):
+        """Print the time sheets, then keep them current: every interval seconds, sync the event store
+        and print the client weeks that changed events touched, with the client's new total.
+
+        Each poll only transfers the changed events (sync token) and only rebuilds the affected client
+        weeks, see IncrementalSheets. Runs until interrupted, or for the given number of polls.
+        """
+        if self.event_store is None or self.offline:
+            raise ValueError("Watch mode requires the local event store and access to Google Calendar")
+        cal_ids = self.get_calendar_ids()
+        router = TagRouter(self.client_config.aliases, selected_clients if selected_clients else self.client_list)
+
+        def load():
+            for cal_id in cal_ids:
+                self.sync_calendar(cal_id, time_zone)
+            sheets = IncrementalSheets(router, start_date, end_date, week_totals)
+            for cal_index, cal_id in enumerate(cal_ids):
+                sheets.apply(cal_index, self.event_store.get_events(cal_id, start_date, end_date))
+            for sheet in sheets.sheets():
+                self.print_sheet_summary(sheet, OutputFormat.TABLE)
+            return sheets
+
+        self.output_format = OutputFormat.TABLE
+        sheets = load()
+        poll = 0
+        while polls is None or poll < polls:
+            time.sleep(interval)
+            poll += 1
+            changed = set()
+            with PROFILER.span('watch_update') as span:
+                for cal_index, cal_id in enumerate(cal_ids):
+                    changes = []
+                    self.sync_calendar(cal_id, time_zone, changes)
+                    if None in changes:
+                        break
+                    # A week changed in several calendars (a shared event) is printed once
+                    changed |= sheets.apply(cal_index, changes)
+                else:
+                    span.count = len(changed)
+                    for slice_key in sorted(changed, key=lambda slice_key: (slice_key[1:], slice_key[0])):
+                        self.print_week_update(sheets, slice_key)
+                    continue
+            logging.info("Event store was synced in full, rebuilding all time sheets")
+            sheets = load()
+
+    def print_week_update(self, sheets, slice_key):
+        from tabulate import tabulate
+        client_name, week_nr = slice_key
+        rows = sheets.slice_rows.get(slice_key)
+        print(f"\n{datetime.datetime.now():%H:%M:%S} Week {week_nr} of client {client_name} changed; "
+              f"total duration now {format_duration_hhmm(sheets.total_duration(client_name))}.")
+        if rows:
+            print(tabulate(rows, headers=TimeSheetBuilder.COLUMNS, tablefmt="presto"))
+        else:
+            print("No events left in this week.")
+
+    def build_timesheets(self, events, week_totals=False, selected_clients=None):
+        """Turn fetched events into per-client time sheets with day (and optionally week) totals."""
         client_list_to_process = selected_clients if selected_clients else self.client_list
         time_sheets = self.process_events(events, client_list_to_process)
 
-        for sheet in time_sheets:
-            self.add_totals_to_sheet(sheet, week_totals)
-            self.print_sheet_summary(sheet, output_format)
+        with PROFILER.span('totals', count=len(time_sheets)):
+            for sheet in time_sheets:
+                self.add_totals_to_sheet(sheet, week_totals)
 
         return time_sheets
 
-    def add_totals_to_sheet(self, sheet, week_totals):
-        sheet.time_sheet_df.insert(loc=6, column="Week_total", value="")
-        sheet.time_sheet_df.insert(loc=1, column="Day_total", value="")
+    def build_plain_timesheets(self, events, week_totals=False, selected_clients=None, with_rows=True):
+        """pandas-free build_timesheets for TOTAL and CSV output.
 
-        # Duration is already a timedelta, no need to convert
+        The sheets have no time_sheet_df; with_rows fills in their rows (see TimeSheetBuilder.rows),
+        otherwise only the total durations are computed.
+        """
+        client_list_to_process = selected_clients if selected_clients else self.client_list
+        with PROFILER.span('tag_matching') as span:
+            client_events, _ = self.route_events(events, client_list_to_process)
+            span.count = sum(len(cl_events) for cl_events in client_events.values())
 
-        if week_totals:
-            week_tot_grp = sheet.time_sheet_df.groupby(["Week_nr"])["Week_duration"].last()
-            for index, row in sheet.time_sheet_df.iterrows():
-                if row["Week_nr"] in week_tot_grp.index:
-                    sheet.time_sheet_df.at[index, "Week_total"] = week_tot_grp[row["Week_nr"]]
+        time_sheets = []
+        with PROFILER.span('rows') as span:
+            for cl_name, cl_events in client_events.items():
+                starts, ends, durations = self.event_times_batch([event for event, _ in cl_events])
+                time_sheet = TimeSheetData(cl_name, sum(durations, datetime.timedelta()), time_sheet_df=None)
+                if with_rows:
+                    builder = TimeSheetBuilder()
+                    builder.extend(starts, ends, durations, [description for _, description in cl_events])
+                    time_sheet.rows = builder.rows(week_totals)
+                time_sheets.append(time_sheet)
+            span.count = sum(len(cl_events) for cl_events in client_events.values())
+        return time_sheets
 
-        day_tot_grp = sheet.time_sheet_df.groupby(["Week_nr", "Day"])["Duration"].sum()
-        sheet.time_sheet_df["Day_total"] = sheet.time_sheet_df.groupby(["Week_nr", "Day"])["Duration"].transform('sum')
-        sheet.time_sheet_df["Day_total"] = sheet.time_sheet_df["Day_total"].apply(
-            lambda x: f"{x.total_seconds() // 3600:02.0f}:{(x.total_seconds() // 60) % 60:02.0f}")
+    def render_invoices(self, start_date, end_date, pdf_path, selected_clients=None, week_totals=False,
+                        invoice_number='00000000000', invoice_date=None, selected_columns=None,
+                        append_timesheet=True, render_template=None, job=None):
+        """Render an invoice PDF per client, followed by its time sheet pages, and return their ClientInvoices.
 
-        # Convert Duration to string format for display
-        sheet.time_sheet_df["Duration"] = sheet.time_sheet_df["Duration"].apply(
-            lambda x: f"{x.total_seconds() // 3600:02.0f}:{(x.total_seconds() // 60) % 60:02.0f}")
+        The invoice loop of both the batch CLI (generate_invoices) and the web app's invoice jobs.
+        Events are fetched once for all clients and the PDFs are rendered in parallel worker
+        processes, each written to pdf_path(client_name). A client whose PDF fails gets the
+        exception as its result instead of stopping the others. Clients that are not in
+        clients.yaml or have no tagged hours are left out. selected_columns are form field names
+        from invoicing.TIMESHEET_COLUMNS (None for the defaults). render_template(name, **context)
+        renders the templates, by default through a plain jinja2 environment; job, a jobs.Job, is
+        told the progress of the INVOICE_STAGES. Nothing is printed.
+        """
+        from jobs import Job
+        from pdf_render import render_client_pdfs
+
+        if render_template is None:
+            import jinja2
+            templates = jinja2.Environment(loader=jinja2.FileSystemLoader('templates'),
+                                           autoescape=jinja2.select_autoescape())
+
+            def render_template(name, **context):
+                return templates.get_template(name).render(**context)
+
+        job = job or Job(INVOICE_STAGES)
+        invoice_date = invoice_date or datetime.date.today()
+        if selected_columns is None:
+            selected_columns = DEFAULT_TIMESHEET_COLUMNS
+        # Only PDFs are written, so process_events prints no tag hints either
+        self.output_format = None
+
+        job.start_stage('fetch')
+        events = []
+        with PROFILER.span('fetch') as span:
+            for event in self.get_gcal_events(start_date, end_date):
+                events.append(event)
+                if len(events) % 250 == 0:
+                    job.advance('fetch', len(events))
+            span.count = len(events)
+        job.advance('fetch', len(events))
+        job.finish_stage('fetch')
+
+        job.start_stage('process')
+        with PROFILER.span('process', count=len(events)):
+            timesheets = self.build_timesheets(events, week_totals, selected_clients)
+            # With the event store the totals come from its rollup index, otherwise from the events just fetched
+            client_totals = {totals.client_name: totals for totals in self.client_totals(
+                start_date, end_date, selected_clients, sync=False,
+                events=events if self.event_store is None else None)}
+        job.advance('process', len(timesheets))
+        job.finish_stage('process')
+
+        invoices = []
+        html = []
+        for timesheet in timesheets:
+            client_name = timesheet.client_name
+            totals = client_totals.get(client_name)
+            if client_name not in self.client_config.clients or totals is None or not totals.days:
+                continue
+            invoice_html = render_template('invoice.html', **invoice_context(
+                client_name, self.client_config, totals, invoice_number, invoice_date))
+            timesheet_html = None
+            if append_timesheet:
+                # Timesheet pages (landscape) follow the invoice (portrait) in the same document
+                timesheet_html = render_template('timesheet_pdf.html',
+                                                 **timesheet_pdf_context(timesheet, selected_columns))
+            invoices.append(ClientInvoice(client_name, timesheet, totals, pdf_path(client_name)))
+            html.append((invoice_html, timesheet_html))
+
+        job.start_stage('render', total=len(invoices))
+        with PROFILER.span('render', count=len(invoices)):
+            # Each worker writes its PDF straight to its file
+            results = render_client_pdfs(html, paths=[invoice.path for invoice in invoices],
+                                         progress=lambda done, total: job.advance('render', done))
+        job.finish_stage('render')
+        for invoice, result in zip(invoices, results):
+            invoice.result = result
+        return invoices
+
+    def generate_invoices(self, start_date, end_date, output_dir, selected_clients=None, week_totals=False,
+                          invoice_number='00000000000', invoice_date=None, selected_columns=None,
+                          append_timesheet=True):
+        """Write an invoice PDF per client, followed by its time sheet pages, to output_dir with a manifest.
+
+        See render_invoices. A client whose PDF fails is listed in the manifest with its error
+        instead of stopping the run. Returns the manifest.
+        """
+        invoice_date = invoice_date or datetime.date.today()
+        os.makedirs(output_dir, exist_ok=True)
+
+        def pdf_path(client_name):
+            safe_name = re.sub(r'[^\w.-]+', '_', client_name)
+            return os.path.join(output_dir, f"invoice_{safe_name}_{start_date:%Y%m%d}-{end_date:%Y%m%d}.pdf")
+
+        client_invoices = self.render_invoices(start_date, end_date, pdf_path, selected_clients, week_totals,
+                                               invoice_number, invoice_date, selected_columns, append_timesheet)
+
+        invoices = []
+        for invoice in client_invoices:
+            client_name, totals = invoice.client_name, invoice.totals
+            hours = totals.total_duration.total_seconds() / 3600
+            rate = self.client_config.rates[client_name]
+            entry = {
+                'client': client_name,
+                'file': None,
+                'hours': round(hours, 2),
+                'amount': round(hours * rate['hourly_rate'], 2),
+                'currency': rate['currency'],
+                'first_day': totals.first_day.isoformat(),
+                'last_day': totals.last_day.isoformat(),
+                'weeks': list(totals.week_range()),
+                'error': None,
+            }
+            if invoice.error:
+                logging.error("Error generating PDF for %s: %s", client_name, invoice.error)
+                entry['error'] = str(invoice.error)
+            else:
+                entry['file'] = os.path.basename(invoice.path)
+            invoices.append(entry)
+
+        manifest = {
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'invoice_number': invoice_number,
+            'invoice_date': invoice_date.isoformat(),
+            'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'invoices': invoices,
+        }
+        # Written last and replaced in one step, so a manifest only ever lists finished PDFs
+        manifest_path = os.path.join(output_dir, INVOICE_MANIFEST)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        return manifest
+
+    def add_totals_to_sheet(self, sheet, week_totals):
+        df = sheet.time_sheet_df
+        df.insert(loc=6, column="Week_total", value="")
+        df.insert(loc=1, column="Day_total", value="")
+
+        if week_totals:
+            # Last running week duration of each week number
+            df["Week_total"] = df.groupby("Week_nr")["Week_duration"].transform('last')
+
+        # Duration is still a timedelta64 column here; sum it per day, then format both for display
+        df["Day_total"] = format_hhmm(df.groupby(["Week_nr", "Day"])["Duration"].transform('sum'))
+        df["Duration"] = format_hhmm(df["Duration"])
 
     def print_sheet_summary(self, sheet, output_format: OutputFormat):
         if output_format == OutputFormat.TOTAL:
             total_hours = sheet.total_duration.total_seconds() / 3600
             print(f"{total_hours:.2f}")
         elif output_format == OutputFormat.CSV:
-            print(sheet.time_sheet_df.to_csv(index=False))
+            if sheet.rows is None:
+                print(sheet.time_sheet_df.to_csv(index=False))
+            else:
+                # Same text as DataFrame.to_csv, which also ends lines with os.linesep
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, lineterminator=os.linesep)
+                writer.writerow(TimeSheetBuilder.COLUMNS)
+                writer.writerows(sheet.rows)
+                print(buffer.getvalue())
         else:  # TABLE
+            from tabulate import tabulate
             print(f"\nTime sheet for client: {sheet.client_name}")
             total_hours, remainder = divmod(sheet.total_duration.total_seconds(), 3600)
             total_minutes = remainder // 60
             print(f"Total duration for client was: {total_hours:.0f} hours and {total_minutes:.0f} minutes.")
-            print(tabulate(sheet.time_sheet_df, headers=sheet.time_sheet_df.columns, tablefmt="presto"))
+            if sheet.rows is None:
+                print(tabulate(sheet.time_sheet_df, headers=sheet.time_sheet_df.columns, tablefmt="presto"))
+            else:
+                print(tabulate(sheet.rows, headers=TimeSheetBuilder.COLUMNS, showindex=True, tablefmt="presto"))
 
 
 def main():
@@ -311,10 +1380,78 @@ def main():
                        type=OutputFormat, 
                        choices=list(OutputFormat), 
                        default=OutputFormat.TABLE,
-                       help="Output format (table, csv, or total)")
+                       help="Output format (table, csv, total, the streaming csv-stream and jsonl, which write "
+                            "one row per event of all clients as events arrive, without day and week totals, or "
+                            "parquet and arrow, which write all clients to --output with native types)")
+    parser.add_argument("-o", "--output",
+                        help="With csv-stream or jsonl, write the rows to this file instead of stdout; "
+                             "with parquet or arrow, the file (or, with --partition, directory) to write")
+    parser.add_argument("--partition", action="store_true",
+                        help="With parquet or arrow, write a directory partitioned by client and month")
+    parser.add_argument("--offline", action="store_true",
+                        help="Build the time sheet from the local event store only, without contacting Google")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Fetch events straight from Google Calendar instead of syncing the local event store")
+    parser.add_argument("-wd", "--window-days", type=int, default=None,
+                        help="With --no-cache, fetch long ranges in parallel windows of this many days "
+                             "(default: calendar months, 0: a single request)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print the time, item count and peak memory of each stage to stderr")
+    parser.add_argument("-c", "--clients",
+                        help="Comma separated names of the clients to include (default: all clients in clients.yaml)")
+    parser.add_argument("--invoices", metavar="DIR",
+                        help="Write an invoice PDF per client, with its time sheet pages, and a manifest.json to DIR "
+                             "instead of printing time sheets")
+    parser.add_argument("--invoice-number", default='00000000000', help="With --invoices, the invoice number")
+    parser.add_argument("--invoice-date", help="With --invoices, the invoice date (format: DD/MM/YYYY, default: today)")
+    parser.add_argument("--columns",
+                        help="With --invoices, comma separated time sheet columns of the PDFs "
+                             "(default: Date,Duration,Description)")
+    parser.add_argument("--no-timesheet", action="store_true",
+                        help="With --invoices, leave the time sheet pages out of the PDFs")
+    parser.add_argument("--watch", metavar="SECONDS", type=float, nargs="?", const=WATCH_INTERVAL,
+                        help="Print the time sheets, then poll for changed events (every 60 seconds by default) "
+                             "and print the client weeks they change, until interrupted")
     args = parser.parse_args()
+    if args.offline and args.no_cache:
+        parser.error("--offline cannot be combined with --no-cache")
+    if args.window_days is not None and args.window_days < 0:
+        parser.error("--window-days must be 0 or more")
+    if args.output and not (args.format.streaming or args.format.columnar):
+        parser.error("--output requires the csv-stream, jsonl, parquet or arrow format")
+    if args.format.columnar and not args.output:
+        parser.error(f"The {args.format} format requires --output")
+    if args.partition and not args.format.columnar:
+        parser.error("--partition requires the parquet or arrow format")
+    if args.format.columnar:
+        try:
+            columnar_export.import_pyarrow()
+        except RuntimeError as e:
+            parser.error(str(e))
+    if args.invoices and args.output:
+        parser.error("--invoices cannot be combined with --output")
+    if args.watch is not None:
+        if args.offline or args.no_cache:
+            parser.error("--watch needs the event store and Google Calendar, it cannot be combined with "
+                         "--offline or --no-cache")
+        if args.invoices or args.output or args.format != OutputFormat.TABLE:
+            parser.error("--watch prints tables, it cannot be combined with --invoices, --output or --format")
 
-    generator = TimesheetGenerator()
+    generator = TimesheetGenerator(offline=args.offline, use_event_store=not args.no_cache,
+                                   window_days=args.window_days)
+
+    selected_clients = None
+    if args.clients:
+        selected_clients = [name.strip() for name in args.clients.split(',') if name.strip()]
+        unknown = [name for name in selected_clients if name not in generator.client_config.clients]
+        if unknown:
+            parser.error(f"Unknown client(s) {', '.join(unknown)}; choose from {', '.join(generator.client_list)}")
+    selected_columns = None
+    if args.columns:
+        field_names = {name.lower(): field_name for name, field_name, _ in TIMESHEET_COLUMNS}
+        selected_columns = [field_names.get(name.strip().lower()) for name in args.columns.split(',')]
+        if None in selected_columns:
+            parser.error(f"--columns must be chosen from {', '.join(name for name, _, _ in TIMESHEET_COLUMNS)}")
 
     if args.list_calendars:
         generator.list_calendars()
@@ -332,8 +1469,40 @@ def main():
         start_date = generator.first_day_last_month
         end_date = generator.last_day_last_month
 
-    generator.generate_timesheet(start_date, end_date, args.weektotals, args.format)
+    if args.profile:
+        PROFILER.enable()
+    failed = False
+    with PROFILER.collect() as spans:
+        if args.invoices:
+            invoice_date = parse(args.invoice_date, dayfirst=True).date() if args.invoice_date else None
+            manifest = generator.generate_invoices(start_date, end_date, args.invoices, selected_clients,
+                                                   args.weektotals, args.invoice_number, invoice_date,
+                                                   selected_columns, append_timesheet=not args.no_timesheet)
+            for invoice in manifest['invoices']:
+                print(f"{invoice['client']}: {invoice['file'] or 'FAILED: ' + invoice['error']}")
+            failed = any(invoice['error'] for invoice in manifest['invoices'])
+        elif args.watch is not None:
+            try:
+                generator.watch_timesheet(start_date, end_date, args.weektotals, selected_clients, args.watch)
+            except KeyboardInterrupt:
+                pass
+        elif args.format.columnar:
+            generator.export_timesheet(start_date, end_date, args.output, args.format, args.weektotals,
+                                       selected_clients, partition=args.partition)
+        elif args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                generator.stream_timesheet(start_date, end_date, args.format, selected_clients, file=file)
+        else:
+            generator.generate_timesheet(start_date, end_date, args.weektotals, args.format, selected_clients)
+    if not args.offline:
+        logging.info("Calendar API: %s", generator.service_pool.stats)
+    if args.profile:
+        print(format_summary(spans), file=sys.stderr)
+        if not args.offline:
+            print(f"Calendar API: {generator.service_pool.stats}", file=sys.stderr)
+    # A non-zero exit status tells cron jobs and scripts that an invoice is missing
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
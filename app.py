@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request, jsonify, send_file, url_for, abort, g
 from flask_wtf import FlaskForm
 from wtforms import (DateField, SubmitField, BooleanField, SelectMultipleField,
                      SelectField, StringField)
@@ -7,35 +7,31 @@ from dateutil.parser import parse
 from datetime import datetime, timedelta, date
 import subprocess
 import os
-import io
 import json
 from markupsafe import Markup, escape
-from TimeSheeter import TimesheetGenerator
-from xhtml2pdf import pisa
-from pypdf import PdfWriter, PdfReader
-import yaml
+from TimeSheeter import INVOICE_STAGES, TimesheetGenerator
+from pdf_render import render_pdf, PdfRenderError
+from jobs import JobRegistry
+from profiling import PROFILER, server_timing
+from config_cache import load_clients
+from invoicing import TIMESHEET_COLUMNS, timesheet_pdf_context
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key_here'
 
-# Load client data
-with open('clients.yaml', 'r') as file:
-    clients_data = yaml.safe_load(file)
-
-# All possible timesheet columns: (DataFrame column name, form field name, fixed PDF width)
-# Width is sized to fit header text without wrapping at 9pt Arial; None = Description takes remaining space.
-TIMESHEET_COLUMNS = [
-    ('Date',          'col_date',          '2.3cm'),
-    ('Day_total',     'col_day_total',      '2.0cm'),
-    ('Day',           'col_day',            '1.0cm'),
-    ('Start_time',    'col_start_time',     '2.3cm'),
-    ('End_time',      'col_end_time',       '2.1cm'),
-    ('Duration',      'col_duration',       '2.0cm'),
-    ('Week_total',    'col_week_total',     '2.2cm'),
-    ('Week_nr',       'col_week_nr',        '1.7cm'),
-    ('Week_duration', 'col_week_duration',  '2.6cm'),
-    ('Description',   'col_description',    None),
-]
+# Set TIMESHEETER_PROFILE=1 to time the pipeline stages (Server-Timing headers and /metrics)
+if os.environ.get('TIMESHEETER_PROFILE'):
+    PROFILER.enable()
+
+# Load client data (parsed once here, then again only when clients.yaml changes)
+load_clients()
+
+# Timesheet invoices are generated by background jobs that the page polls for progress
+JOBS = JobRegistry()
+
+# The page loads timesheet rows from job_rows in pages of this many rows; clients may ask for up to ROWS_PAGE_MAX
+ROWS_PAGE_SIZE = 100
+ROWS_PAGE_MAX = 1000
 
 class DateForm(FlaskForm):
     invoice_date = DateField('Invoice Date', format='%Y-%m-%d',
@@ -66,26 +62,20 @@ class DateForm(FlaskForm):
 def index():
     form = DateForm()
 
-    # Reload clients data dynamically to catch any changes
-    with open('clients.yaml', 'r') as file:
-        current_clients_data = yaml.safe_load(file)
+    # Cached client data; reloaded only when clients.yaml has changed
+    client_config = load_clients()
 
-    client_choices = [(key, data.get('trade_name', key))
-                      for key, data in current_clients_data.get('Clients', {}).items()]
+    client_choices = client_config.choices
     form.clients.choices = client_choices
     form.simple_client.choices = [('', '— select client —')] + client_choices
 
-    client_rates = {
-        key: {'hourly_rate': float(data.get('hourly_rate', 90.0)),
-              'currency': data.get('currency', '€')}
-        for key, data in current_clients_data.get('Clients', {}).items()
-    }
+    client_rates = client_config.rates
 
-    def render(error=None, timesheets_data=None, simple_rows=None):
+    def render(error=None, simple_rows=None, job_id=None):
         return render_template('timesheet.html', form=form,
                                client_rates=client_rates,
-                               error=error, timesheets_data=timesheets_data,
-                               simple_rows=simple_rows)
+                               error=error,
+                               simple_rows=simple_rows, job_id=job_id)
 
     # --- Simple invoice ---
     if request.method == 'POST' and form.simple_submit.data:
@@ -100,12 +90,12 @@ def index():
         if not client_key:
             return render(error="Please select a client for the simple invoice.")
 
-        client_data = current_clients_data['Clients'].get(client_key)
-        if not client_data:
+        client_data = client_config.clients.get(client_key)
+        if client_data is None:
             return render(error=f"Client '{client_key}' not found in clients.yaml.")
 
-        hourly_rate = float(client_data.get('hourly_rate', 90.0))
-        currency    = client_data.get('currency', '€')
+        hourly_rate = client_config.rates[client_key]['hourly_rate']
+        currency    = client_config.rates[client_key]['currency']
         logo_path   = os.path.abspath('templates/logo.jpg')
         price_str   = f"{hourly_rate:.2f}".replace('.', ',')
 
@@ -151,9 +141,10 @@ def index():
         pdf_path = f'invoice_{client_key}_{datetime.now().strftime("%Y%m%d%H%M%S")}.pdf'
 
         try:
-            with open(pdf_path, 'w+b') as pdf_file:
-                status = pisa.CreatePDF(invoice_html, dest=pdf_file, encoding='utf-8')
-            if status.err:
+            try:
+                with PROFILER.span('render', count=1):
+                    render_pdf(invoice_html, path=pdf_path)
+            except PdfRenderError:
                 return render(error=f"Error generating PDF for {client_key}.")
             if os.name == 'nt':
                 os.startfile(pdf_path)
@@ -168,148 +159,176 @@ def index():
     if form.validate_on_submit():
         start_date = form.start_date.data
         end_date = form.end_date.data
-        selected_clients = form.clients.data
-        
+
         # Format dates for TimesheetGenerator
         start_date_str = start_date.strftime('%d/%m/%Y')
         end_date_str = end_date.strftime('%d/%m/%Y')
 
-        # Generate Timesheet
-        try:
-            generator = TimesheetGenerator()
-            timesheets = generator.generate_timesheet(
-                parse(start_date_str, dayfirst=True),
-                parse(end_date_str, dayfirst=True).replace(hour=23, minute=59, second=59),
-                week_totals=form.week_totals.data,
-                selected_clients=selected_clients
-            )
-        except Exception as e:
-            return render(error=f"Error generating timesheet: {str(e)}")
-
-        if timesheets:
-            timesheets_data = []
-
-            for timesheet in timesheets:
-                client_name = timesheet.client_name
-                total_hours, remainder = divmod(timesheet.total_duration.total_seconds(), 3600)
-                total_minutes = remainder / 3600  # Convert minutes to decimal hours
-                total_hours_decimal = total_hours + total_minutes
-
-                # Get client data
-                client_data = current_clients_data['Clients'].get(client_name)
-                if not client_data:
-                    continue
-                client_reg_name = client_data.get('registration_name', client_name)
-
-                # Get week numbers and dates from the timesheet data
-                timesheet_df = timesheet.time_sheet_df
-                if timesheet_df.empty:
-                    continue
-                start_week = min(timesheet_df['Week_nr'])
-                end_week = max(timesheet_df['Week_nr'])
-                
-                # Get first and last day from the timesheet
-                first_day = timesheet_df.iloc[0]['Date']  # First row's full date
-                last_day = timesheet_df.iloc[-1]['Date']  # Last row's full date
-                logo_path = os.path.abspath('templates/logo.jpg')
-
-                hourly_rate = float(client_data.get('hourly_rate', 90.0))
-                currency = client_data.get('currency', '€')
-                total_price = total_hours_decimal * hourly_rate
-                price_str = f"{hourly_rate:.2f}".replace('.', ',')
-
-                inv_date = form.invoice_date.data
-                invoice_data = {
-                    'client': client_data,
-                    'invoice_number': form.invoice_number.data or '00000000000',
-                    'invoice_date': inv_date.strftime('%d-%m-%Y'),
-                    'due_date': (inv_date + timedelta(days=30)).strftime('%d-%m-%Y'),
-                    'reference': 'Georges Meinders',
-                    'items': [{
-                        'quantity': f'{total_hours_decimal:.2f} hours',
-                        'description': f'Delivered engineering services to {client_reg_name} for week {start_week} up to and including week {end_week} ({first_day} up to and including {last_day}).',
-                        'price': price_str,
-                        'total': f'{total_price:.2f}',
-                        'vat_rate': '0,00'
-                    }],
-                    'vat_calculation_text': f'0.00% VAT on {currency} {total_price:.2f} = {currency} 0,00',
-                    'total_amount': f'{currency} {total_price:.2f}',
-                    'logo_path': logo_path,
-                }
-
-                # Generate invoice HTML
-                invoice_html = render_template('invoice.html', **invoice_data)
-
-                # Define PDF path
-                pdf_path = f'invoice_{client_name}_{datetime.now().strftime("%Y%m%d%H%M%S")}.pdf'
-
-                try:
-                    if form.append_timesheet.data:
-                        # Build filtered column list (name, width) based on selected checkboxes
-                        selected_col_info = [
-                            (col, width) for col, field_name, width in TIMESHEET_COLUMNS
-                            if getattr(form, field_name).data and col in timesheet.time_sheet_df.columns
-                        ] or [(col, width) for col, _, width in TIMESHEET_COLUMNS
-                              if col in timesheet.time_sheet_df.columns]
-                        selected_cols = [col for col, _ in selected_col_info]
-                        filtered_df = timesheet.time_sheet_df[selected_cols]
-
-                        # Generate invoice PDF in memory (portrait)
-                        invoice_buffer = io.BytesIO()
-                        status1 = pisa.CreatePDF(invoice_html, dest=invoice_buffer, encoding='utf-8')
-                        if status1.err:
-                            return render(error=f"Error generating PDF invoice for {client_name}.")
-
-                        # Generate timesheet PDF in memory (landscape)
-                        timesheet_pdf_html = render_template('timesheet_pdf.html',
-                            client_name=client_name,
-                            first_day=first_day,
-                            last_day=last_day,
-                            timesheet_cols=[{'name': col, 'width': width} for col, width in selected_col_info],
-                            timesheet_rows=filtered_df.fillna('').values.tolist(),
-                        )
-                        timesheet_buffer = io.BytesIO()
-                        status2 = pisa.CreatePDF(timesheet_pdf_html, dest=timesheet_buffer, encoding='utf-8')
-                        if status2.err:
-                            return render(error=f"Error generating timesheet PDF for {client_name}.")
-
-                        # Merge invoice + timesheet PDFs
-                        invoice_buffer.seek(0)
-                        timesheet_buffer.seek(0)
-                        writer = PdfWriter()
-                        for reader in [PdfReader(invoice_buffer), PdfReader(timesheet_buffer)]:
-                            for page in reader.pages:
-                                writer.add_page(page)
-                        with open(pdf_path, 'wb') as f:
-                            writer.write(f)
-                    else:
-                        with open(pdf_path, 'w+b') as pdf_file:
-                            pisa_status = pisa.CreatePDF(invoice_html, dest=pdf_file, encoding='utf-8')
-                        if pisa_status.err:
-                            return render(error=f"Error generating PDF invoice for {client_name}.")
-
-                    # Open PDF file
-                    if os.name == 'nt':  # Windows
-                        os.startfile(pdf_path)
-                    else:  # Linux/Mac
-                        subprocess.run(['xdg-open', pdf_path])
-
-                except Exception as e:
-                    print(f"Error generating PDF for {client_name}: {str(e)}")
-                    return render(error=f"Error generating PDF for {client_name}: {str(e)}")
+        params = {
+            'start_date': parse(start_date_str, dayfirst=True),
+            'end_date': parse(end_date_str, dayfirst=True).replace(hour=23, minute=59, second=59),
+            'selected_clients': form.clients.data,
+            'week_totals': form.week_totals.data,
+            'append_timesheet': form.append_timesheet.data,
+            'selected_columns': [field_name for _, field_name, _ in TIMESHEET_COLUMNS
+                                 if getattr(form, field_name).data],
+            'invoice_number': form.invoice_number.data or '00000000000',
+            'invoice_date': form.invoice_date.data,
+            'client_config': client_config,
+        }
+        job = JOBS.submit(generate_invoices, params, stages=INVOICE_STAGES)
+
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(dict(job.to_dict(), status_url=url_for('job_status', job_id=job.id))), 202
+        return render(job_id=job.id)
+
+    return render()
 
+def generate_invoices(job, params):
+    """Background job for the timesheet invoice form: fetch events, build timesheets, render PDFs."""
+    with app.app_context():
+        generator = TimesheetGenerator()
+        client_invoices = generator.render_invoices(
+            params['start_date'], params['end_date'],
+            lambda client_name: f'invoice_{client_name}_{datetime.now().strftime("%Y%m%d%H%M%S")}.pdf',
+            params['selected_clients'], params['week_totals'], params['invoice_number'], params['invoice_date'],
+            params['selected_columns'], params['append_timesheet'], render_template=render_template, job=job)
+        if not client_invoices:
+            raise ValueError("No timesheets generated.")
+
+        # Open the PDFs in client order
+        timesheets_data = []
+        errors = []
+        for invoice in client_invoices:
+            client_name = invoice.client_name
+            try:
+                if invoice.error:
+                    raise invoice.error
+
+                # Open PDF file
+                if os.name == 'nt':  # Windows
+                    os.startfile(invoice.path)
+                else:  # Linux/Mac
+                    subprocess.run(['xdg-open', invoice.path])
+
+                total_hours, remainder = divmod(invoice.totals.total_duration.total_seconds(), 3600)
+                timesheet_df = invoice.timesheet.time_sheet_df
                 timesheets_data.append({
                     'client_name': client_name,
                     'total_hours': f"{total_hours:.0f} hours and {remainder//60:.0f} minutes",
-                    'table': timesheet.time_sheet_df.to_html(index=False)
+                    # Served a page at a time by job_rows
+                    'columns': list(timesheet_df.columns),
+                    'rows': timesheet_df.fillna('').values.tolist(),
+                    'pdf_path': invoice.path,
                 })
+            except Exception as e:
+                print(f"Error generating PDF for {client_name}: {str(e)}")
+                errors.append(f"Error generating PDF for {client_name}: {str(e)}")
+
+        return {'timesheets': timesheets_data, 'errors': errors}
+
+
+def render_timesheet_pdf_html(timesheet, selected_columns):
+    """Render the timesheet_pdf.html pages of one client with the selected form columns (all when none match)."""
+    return render_template('timesheet_pdf.html', **timesheet_pdf_context(timesheet, selected_columns))
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        abort(404)
+    status = job.to_dict()
+    if job.finished is not None:
+        # The job ran on a worker thread; report its stages as if this request had run them
+        g.extra_spans = job.spans
+        status['spans'] = [span.to_dict() for span in job.spans]
+    if job.state == 'done':
+        status['errors'] = job.result['errors']
+        status['timesheets'] = [
+            {'client_name': ts['client_name'],
+             'total_hours': ts['total_hours'],
+             'row_count': len(ts['rows']),
+             'rows_url': url_for('job_rows', job_id=job.id, index=index),
+             'download_url': url_for('job_file', job_id=job.id, index=index)}
+            for index, ts in enumerate(job.result['timesheets'])
+        ]
+    return jsonify(status)
+
+
+@app.route('/jobs/<job_id>/files/<int:index>')
+def job_file(job_id, index):
+    job = JOBS.get(job_id)
+    if job is None or job.state != 'done' or not 0 <= index < len(job.result['timesheets']):
+        abort(404)
+    return send_file(os.path.abspath(job.result['timesheets'][index]['pdf_path']),
+                     mimetype='application/pdf', as_attachment=True)
+
+
+@app.route('/jobs/<job_id>/timesheets/<int:index>/rows')
+def job_rows(job_id, index):
+    """Return a page of one client's timesheet rows as JSON.
+
+    Query parameters: offset (default 0), limit (default ROWS_PAGE_SIZE) and columns, a comma
+    separated list of TIMESHEET_COLUMNS names (default: all of them). next_url is included while
+    there are more rows.
+    """
+    job = JOBS.get(job_id)
+    if job is None or job.state != 'done' or not 0 <= index < len(job.result['timesheets']):
+        abort(404)
+    timesheet = job.result['timesheets'][index]
+
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', ROWS_PAGE_SIZE, type=int)
+    if offset < 0 or not 0 < limit <= ROWS_PAGE_MAX:
+        abort(400, description=f"offset must be 0 or more and limit between 1 and {ROWS_PAGE_MAX}")
+
+    # Columns are listed in the order of the time sheet, as the PDF pages and CLI output show them
+    available = [col for col in timesheet['columns'] if col in {name for name, _, _ in TIMESHEET_COLUMNS}]
+    requested = request.args.get('columns')
+    columns = requested.split(',') if requested else available
+    if any(col not in available for col in columns):
+        abort(400, description=f"columns must be chosen from {', '.join(available)}")
+    positions = [timesheet['columns'].index(col) for col in columns]
+
+    rows = timesheet['rows']
+    page = {
+        'client_name': timesheet['client_name'],
+        'columns': columns,
+        'rows': [[row[position] for position in positions] for row in rows[offset:offset + limit]],
+        'offset': offset,
+        'total': len(rows),
+    }
+    if offset + limit < len(rows):
+        page['next_url'] = url_for('job_rows', job_id=job.id, index=index, offset=offset + limit, limit=limit,
+                                   columns=requested)
+    return jsonify(page)
 
-            # Return the timesheet view
-            return render(timesheets_data=timesheets_data)
-        else:
-            return render(error="No timesheets generated.")
 
-    return render()
+@app.route('/metrics')
+def metrics():
+    return Response(PROFILER.metrics_text(), mimetype='text/plain; version=0.0.4')
+
+
+@app.before_request
+def start_request_spans():
+    if PROFILER.enabled:
+        g.spans = PROFILER.start_collecting()
+
+
+@app.after_request
+def add_server_timing(response):
+    spans = g.get('spans', []) + g.get('extra_spans', [])
+    if spans:
+        response.headers['Server-Timing'] = server_timing(spans)
+    return response
+
+
+@app.teardown_request
+def stop_request_spans(exc):
+    if 'spans' in g:
+        PROFILER.stop_collecting(g.spans)
+
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
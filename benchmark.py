@@ -0,0 +1,349 @@
+"""Micro-benchmarks for TimeSheeter.
+
+Usage:
+    python benchmark.py parse [-n COUNT] [-r REPEAT]
+    python benchmark.py pipeline [-n EVENTS] [-c CLIENTS] [--days DAYS] [--pdf-rows ROWS] [-o RESULTS] ...
+    python benchmark.py startup [-n EVENTS] [-r REPEAT] [-o RESULTS]
+
+The pipeline benchmark runs on synthetic events served by fake_calendar.FakeCalendarService, so no
+Google account is needed. It works in a temporary directory with generated clients.yaml and
+config.ini files. The startup benchmark times cold starts of the CLI in fresh interpreters, running
+it --offline on an event store filled with synthetic events. Both append one JSON line per run to
+the results file for tracking regressions.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import yaml
+from dateutil.parser import parse
+
+import TimeSheeter
+from TimeSheeter import parse_timestamp, TimesheetGenerator, TimeSheetData, OutputFormat
+from event_store import EventStore
+from fake_calendar import FakeCalendarService, FakeServicePool
+
+BENCH_CALENDAR_ID = 'bench@example.com'
+
+CLIENT_NAMES = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Vandelay Industries', 'Stark',
+                'Wayne Enterprises', 'Wonka', 'Tyrell', 'Cyberdyne', 'Soylent', 'Oscorp', 'Nakatomi',
+                'Aperture', 'Dunder Mifflin']
+
+WORDS = ['meeting', 'review', 'design', 'implement', 'fix', 'deploy', 'test', 'call', 'report', 'plan',
+         'refactor', 'document', 'support', 'analysis', 'workshop', 'the', 'of', 'new', 'pipeline']
+
+
+def sample_timestamps(count):
+    """Return Calendar API style start/end values: offsets, UTC 'Z' times and all-day dates."""
+    start = datetime.datetime(2024, 1, 1, 8, 0)
+    values = []
+    for i in range(count):
+        moment = start + datetime.timedelta(minutes=45 * i)
+        if i % 10 == 0:
+            values.append(moment.date().isoformat())
+        elif i % 10 == 1:
+            values.append(moment.isoformat() + 'Z')
+        else:
+            values.append(moment.isoformat() + '+01:00')
+    return values
+
+
+def bench_parse(count, repeat):
+    values = sample_timestamps(count)
+    assert [parse_timestamp(v) for v in values] == [parse(v) for v in values]
+
+    results = {}
+    for name, func in [('dateutil.parser.parse', parse), ('parse_timestamp', parse_timestamp)]:
+        best = min(timeit.repeat(lambda: [func(v) for v in values], number=1, repeat=repeat))
+        results[name] = best
+        print(f"{name:24} {best * 1e3:8.2f} ms for {count} timestamps ({best / count * 1e6:.2f} us each)")
+    print(f"speedup: {results['dateutil.parser.parse'] / results['parse_timestamp']:.1f}x")
+
+
+def synthetic_clients(count):
+    """Return clients.yaml data for count clients; every other client has an alias_tag."""
+    clients = {}
+    for i, name in enumerate(CLIENT_NAMES[:count]):
+        client = {'registration_name': f'{name} B.V.', 'hourly_rate': 80 + 5 * i, 'currency': '€'}
+        if i % 2 == 0:
+            client['alias_tag'] = name.replace(' ', '') + 'Corp'
+        clients[name] = client
+    return {'Clients': clients}
+
+
+def tag_styles(alias):
+    """Tags people write for a client: @acme, @Acme, a prefix like @acm and @Acme: with punctuation."""
+    word = alias.split()[0]
+    return ['@' + word.lower(), '@' + word, '@' + word[:4].lower(), '@' + word + ':']
+
+
+def synthetic_events(count, clients_yaml, start, days, mix='zipf', all_day_ratio=0.05, long_ratio=0.1,
+                     untagged_ratio=0.1, multi_client_ratio=0.05, seed=0):
+    """Return count Calendar API events spread over days days from start, ordered by start time.
+
+    Most summaries tag one client (some two) in one of the tag_styles, at a random position. With
+    mix='zipf' the first clients get most of the events, with 'uniform' all get the same share.
+    """
+    rnd = random.Random(seed)
+    aliases = [str(data.get('alias_tag', name)) for name, data in clients_yaml['Clients'].items()]
+    weights = [1 / rank for rank in range(1, len(aliases) + 1)] if mix == 'zipf' else None
+    quarters = days * 24 * 4
+    starts = sorted(start + datetime.timedelta(minutes=15 * rnd.randrange(quarters)) for _ in range(count))
+
+    events = []
+    for i, event_start in enumerate(starts):
+        words = rnd.choices(WORDS, k=rnd.randint(2, 6))
+        if rnd.random() < long_ratio:
+            words += rnd.choices(WORDS, k=rnd.randint(50, 200))
+        if rnd.random() >= untagged_ratio:
+            for alias in rnd.choices(aliases, weights, k=2 if rnd.random() < multi_client_ratio else 1):
+                words.insert(rnd.randint(0, len(words)), rnd.choice(tag_styles(alias)))
+
+        event = {'kind': 'calendar#event', 'id': f'bench{i:07d}', 'status': 'confirmed',
+                 'etag': f'"{rnd.getrandbits(48)}"', 'summary': ' '.join(words),
+                 'htmlLink': f'https://www.google.com/calendar/event?eid=bench{i:07d}'}
+        if rnd.random() < all_day_ratio:
+            event['start'] = {'date': event_start.date().isoformat()}
+            event['end'] = {'date': (event_start.date() + datetime.timedelta(days=1)).isoformat()}
+        else:
+            event_end = event_start + datetime.timedelta(minutes=15 * rnd.randint(1, 16))
+            event['start'] = {'dateTime': event_start.isoformat() + '+01:00', 'timeZone': 'Europe/Amsterdam'}
+            event['end'] = {'dateTime': event_end.isoformat() + '+01:00', 'timeZone': 'Europe/Amsterdam'}
+        events.append(event)
+    return events
+
+
+@contextlib.contextmanager
+def timed(timings, name):
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+# Stand-in for the local invoice.html template: one portrait page ahead of the timesheet pages
+BENCHMARK_INVOICE_HTML = '<html><head><style>@page { size: A4 portrait; }</style></head><body><h1>Invoice</h1></body></html>'
+
+
+def render_pdfs(time_sheets, timings, max_rows):
+    """Time the Flask invoice path for the client PDFs: template rendering and PDF rendering.
+
+    invoice.html is a local template that is not part of the repository, so a one-line stand-in
+    invoice is followed by the real timesheet pages, for at most max_rows rows per client (xhtml2pdf
+    needs ~15 ms per row). The PDF cache lives in the current (temporary) directory and is cleared first.
+    """
+    # Imported here: app loads clients.yaml from the current directory on import
+    from app import app, render_timesheet_pdf_html
+    from pdf_render import PDF_CACHE, render_client_pdfs
+
+    for entry in os.scandir(PDF_CACHE.directory) if os.path.isdir(PDF_CACHE.directory) else []:
+        os.remove(entry.path)
+
+    with timed(timings, 'pdf_html'), app.app_context():
+        jobs = [(BENCHMARK_INVOICE_HTML,
+                 render_timesheet_pdf_html(TimeSheetData(sheet.client_name, sheet.total_duration,
+                                                         sheet.time_sheet_df.head(max_rows)),
+                                           selected_columns=()))
+                for sheet in time_sheets]
+    with timed(timings, 'pdf_render'):
+        rendered = render_client_pdfs(jobs)
+    for result in rendered:
+        if isinstance(result, Exception):
+            raise result
+
+
+def run_pipeline(service, start, end, pdf_rows):
+    """Run one timed pass through the TimesheetGenerator stages; return (timings, counts)."""
+    timings = {}
+    generator = TimesheetGenerator(use_event_store=False, service_pool=FakeServicePool(service))
+    generator.output_format = OutputFormat.TOTAL
+
+    with timed(timings, 'fetch'):
+        events = list(generator.get_gcal_events(start, end))
+    with timed(timings, 'tag_matching'):
+        client_events, _ = generator.route_events(events, generator.client_list)
+    with timed(timings, 'process_client_events'):
+        time_sheets = [generator.process_client_events(cl_events, cl_name)
+                       for cl_name, cl_events in client_events.items()]
+        time_sheets = [sheet for sheet in time_sheets if not sheet.time_sheet_df.empty]
+    with timed(timings, 'add_totals_to_sheet'):
+        for sheet in time_sheets:
+            generator.add_totals_to_sheet(sheet, week_totals=True)
+    for output_format in (OutputFormat.TABLE, OutputFormat.CSV, OutputFormat.TOTAL):
+        with timed(timings, f'output_{output_format}'), contextlib.redirect_stdout(io.StringIO()):
+            for sheet in time_sheets:
+                generator.print_sheet_summary(sheet, output_format)
+    with timed(timings, 'output_stream'):
+        generator.write_stream(events, OutputFormat.CSV_STREAM, None, io.StringIO())
+    if pdf_rows:
+        render_pdfs(time_sheets, timings, pdf_rows)
+
+    counts = {'events': len(events), 'clients': len(time_sheets),
+              'rows': sum(len(sheet.time_sheet_df) for sheet in time_sheets)}
+    return timings, counts
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_pipeline(args):
+    output = os.path.abspath(args.output)
+    start = datetime.datetime(2024, 1, 1)
+    end = start + datetime.timedelta(days=args.days)
+    clients_yaml = synthetic_clients(args.clients)
+    events = synthetic_events(args.events, clients_yaml, start, args.days, mix=args.mix,
+                              all_day_ratio=args.all_day_ratio, long_ratio=args.long_ratio, seed=args.seed)
+    service = FakeCalendarService(events, BENCH_CALENDAR_ID, latency=args.latency / 1000)
+    TimeSheeter.EVENTS_PAGE_SIZE = args.page_size
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('xhtml2pdf').setLevel(logging.ERROR)
+
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with open('clients.yaml', 'w') as f:
+                yaml.safe_dump(clients_yaml, f, allow_unicode=True)
+            with open('config.ini', 'w') as f:
+                f.write(f"[Google Calendar]\nCalID = {BENCH_CALENDAR_ID}\n")
+            for _ in range(args.repeat):
+                timings, counts = run_pipeline(service, start, end, pdf_rows=args.pdf_rows)
+                runs.append(timings)
+        finally:
+            os.chdir(cwd)
+
+    print(f"{counts['events']} events, {counts['clients']} clients, {counts['rows']} rows, "
+          f"best of {args.repeat} run(s):")
+    report(args, output, runs, counts)
+
+
+def report(args, output, runs, counts):
+    """Print the best and median time of each stage over runs and append them to the results file."""
+    stages = {name: {'best': min(run[name] for run in runs),
+                     'median': statistics.median(run[name] for run in runs),
+                     'runs': [run[name] for run in runs]}
+              for name in runs[0]}
+    result = {
+        'benchmark': args.benchmark,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': {key: value for key, value in vars(args).items() if key not in ('benchmark', 'output')},
+        'counts': counts,
+        'stages': stages,
+    }
+    with open(output, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+    for name, stage in stages.items():
+        print(f"{name:24} {stage['best'] * 1e3:10.2f} ms   (median {stage['median'] * 1e3:.2f} ms)")
+    print(f"Results appended to {output}")
+
+
+def bench_startup(args):
+    output = os.path.abspath(args.output)
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(package_dir, 'TimeSheeter.py')
+    clients_yaml = synthetic_clients(8)
+    events = synthetic_events(args.events, clients_yaml, datetime.datetime(2024, 1, 1), 365)
+    report_range = ['--offline', '-s', '01/01/2024', '-e', '31/12/2024']
+    commands = {
+        'python': [sys.executable, '-c', 'pass'],
+        'import': [sys.executable, '-c', 'import TimeSheeter'],
+        # What importing TimeSheeter cost when it loaded all of its dependencies up front
+        'import_eager': [sys.executable, '-c', 'import pandas, tabulate, googleapiclient.discovery, '
+                                               'google_auth_oauthlib.flow, TimeSheeter'],
+        'help': [sys.executable, script, '--help'],
+        'total': [sys.executable, script, '-f', 'total'] + report_range,
+        'csv': [sys.executable, script, '-f', 'csv'] + report_range,
+        'table': [sys.executable, script, '-f', 'table'] + report_range,
+    }
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_dir, os.environ.get('PYTHONPATH')])))
+
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, 'clients.yaml'), 'w') as f:
+            yaml.safe_dump(clients_yaml, f, allow_unicode=True)
+        with open(os.path.join(workdir, 'config.ini'), 'w') as f:
+            f.write(f"[Google Calendar]\nCalID = {BENCH_CALENDAR_ID}\n")
+        store = EventStore(os.path.join(workdir, 'events.db'))
+        store.sync(FakeCalendarService(events, BENCH_CALENDAR_ID), BENCH_CALENDAR_ID)
+        store.close()
+
+        for _ in range(args.repeat):
+            timings = {}
+            for name, command in commands.items():
+                start = time.perf_counter()
+                subprocess.run(command, cwd=workdir, env=env, check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                timings[name] = time.perf_counter() - start
+            runs.append(timings)
+
+    print(f"Cold start of the CLI, {args.events} stored events, best of {args.repeat} run(s):")
+    report(args, output, runs, {'events': args.events})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run TimeSheeter micro-benchmarks.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    parse_parser = subparsers.add_parser("parse", help="Event timestamp parsing")
+    parse_parser.add_argument("-n", "--count", type=int, default=20000, help="Number of timestamps")
+    parse_parser.add_argument("-r", "--repeat", type=int, default=5, help="Repetitions, the best is reported")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="Time sheet stages on a synthetic calendar")
+    pipeline_parser.add_argument("-n", "--events", type=int, default=20000, help="Number of events")
+    pipeline_parser.add_argument("-c", "--clients", type=int, default=8, choices=range(1, len(CLIENT_NAMES) + 1),
+                                 metavar=f"1-{len(CLIENT_NAMES)}", help="Number of clients")
+    pipeline_parser.add_argument("--days", type=int, default=365, help="Length of the reported range in days")
+    pipeline_parser.add_argument("--mix", choices=["zipf", "uniform"], default="zipf",
+                                 help="How events are spread over the clients")
+    pipeline_parser.add_argument("--all-day-ratio", type=float, default=0.05, help="Share of all-day events")
+    pipeline_parser.add_argument("--long-ratio", type=float, default=0.1,
+                                 help="Share of events with a long description")
+    pipeline_parser.add_argument("--page-size", type=int, default=TimeSheeter.EVENTS_PAGE_SIZE,
+                                 help="Events per API page")
+    pipeline_parser.add_argument("--latency", type=float, default=0.0,
+                                 help="Simulated API latency per page in milliseconds")
+    pipeline_parser.add_argument("--seed", type=int, default=0, help="Random seed of the event generator")
+    pipeline_parser.add_argument("--pdf-rows", type=int, default=100,
+                                 help="Rows per client rendered by the Flask PDF stages, 0 skips them")
+    pipeline_parser.add_argument("-r", "--repeat", type=int, default=3, help="Repetitions")
+    pipeline_parser.add_argument("-o", "--output", default="benchmark_results.jsonl",
+                                 help="JSON lines file the results are appended to")
+
+    startup_parser = subparsers.add_parser("startup", help="CLI cold start in fresh interpreters")
+    startup_parser.add_argument("-n", "--events", type=int, default=2000, help="Number of stored events")
+    startup_parser.add_argument("-r", "--repeat", type=int, default=5, help="Repetitions")
+    startup_parser.add_argument("-o", "--output", default="benchmark_results.jsonl",
+                                help="JSON lines file the results are appended to")
+    args = parser.parse_args()
+
+    if args.benchmark == "parse":
+        bench_parse(args.count, args.repeat)
+    elif args.benchmark == "pipeline":
+        bench_pipeline(args)
+    elif args.benchmark == "startup":
+        bench_startup(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import contextlib
+import datetime
+import logging
+import os.path
+import pickle
+import threading
+
+# The Google client libraries take a few hundred milliseconds to import, so they are imported where
+# they are used; runs that never talk to Google, such as --offline ones, skip them.
+
+# If modifying these scopes, delete the file token.pickle.
+SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+
+# Credentials are refreshed this long before they expire, so no API call ever waits on a refresh
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Partial response mask for events().list: only the fields the time sheets and the event store read
+EVENT_LIST_FIELDS = 'nextPageToken,nextSyncToken,items(id,status,summary,start,end)'
+
+# Google only gzips responses for clients that accept gzip and mention it in their user agent
+USER_AGENT = 'TimeSheeter (gzip)'
+
+
+class TransferStats:
+    """Counts Calendar API responses and their bytes on the wire and after decompression."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.responses = 0
+        self.wire_bytes = 0
+        self.payload_bytes = 0
+
+    def add(self, wire_bytes, payload_bytes):
+        with self._lock:
+            self.responses += 1
+            self.wire_bytes += wire_bytes
+            self.payload_bytes += payload_bytes
+
+    def __str__(self):
+        return (f"{self.responses} responses, {self.wire_bytes / 1024:.1f} KiB transferred "
+                f"({self.payload_bytes / 1024:.1f} KiB uncompressed)")
+
+
+def counting_http(stats):
+    """Return an httplib2.Http that adds the size of every response, before and after gzip decoding, to stats."""
+    import httplib2
+
+    class CountingHttp(httplib2.Http):
+        def _conn_request(self, conn, request_uri, method, body, headers):
+            wire_bytes = 0
+            getresponse = conn.getresponse
+
+            # httplib2 decompresses the body before returning it, so the raw reads are counted here
+            def counting_getresponse():
+                response = getresponse()
+                read = response.read
+
+                def counting_read(*args):
+                    nonlocal wire_bytes
+                    data = read(*args)
+                    wire_bytes += len(data)
+                    return data
+
+                response.read = counting_read
+                return response
+
+            conn.getresponse = counting_getresponse
+            try:
+                response, content = super()._conn_request(conn, request_uri, method, body, headers)
+            finally:
+                del conn.getresponse
+            stats.add(wire_bytes, len(content))
+            return response, content
+
+    return CountingHttp()
+
+
+class CalendarServicePool:
+    """Process-wide cache of OAuth credentials and authorized Calendar API clients.
+
+    Credentials are unpickled once and refreshed ahead of expiry. Built services are kept
+    in a pool and reused, so their HTTP connections stay alive between calls. httplib2 is not
+    thread-safe, so each service is handed to one caller at a time.
+    """
+
+    def __init__(self, token_path='token.pickle', secrets_path='client_secrets.json'):
+        self.token_path = token_path
+        self.secrets_path = secrets_path
+        self._lock = threading.Lock()
+        self._creds = None
+        self._idle_services = []
+        self.stats = TransferStats()
+
+    def get_credentials(self):
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load_token()
+            creds = self._creds
+            if creds and creds.valid and not self._expires_soon(creds):
+                return creds
+
+            if creds and creds.refresh_token:
+                from google.auth.exceptions import RefreshError
+                from google.auth.transport.requests import Request
+                try:
+                    creds.refresh(Request())
+                except RefreshError:
+                    logging.warning("Refresh token expired or invalid. Restarting auth process.")
+                    creds = self._run_auth_flow()
+            else:
+                creds = self._run_auth_flow()
+            if creds is not self._creds:
+                # Pooled services are bound to the old credentials object
+                self._idle_services.clear()
+            self._creds = creds
+            with open(self.token_path, 'wb') as token:
+                pickle.dump(creds, token)
+            return creds
+
+    @contextlib.contextmanager
+    def service(self):
+        """Check out an authorized Calendar service, returning it to the pool afterwards."""
+        creds = self.get_credentials()
+        with self._lock:
+            service = self._idle_services.pop() if self._idle_services else None
+        if service is None:
+            import google_auth_httplib2
+            from googleapiclient.discovery import build
+            from googleapiclient.http import set_user_agent
+            http = google_auth_httplib2.AuthorizedHttp(creds, http=counting_http(self.stats))
+            http = set_user_agent(http, USER_AGENT)
+            service = build('calendar', 'v3', http=http, cache_discovery=False)
+        try:
+            yield service
+        finally:
+            with self._lock:
+                if creds is self._creds:
+                    self._idle_services.append(service)
+
+    def _load_token(self):
+        if not os.path.exists(self.token_path):
+            return None
+        try:
+            with open(self.token_path, 'rb') as token:
+                return pickle.load(token)
+        except Exception as e:
+            logging.warning(f"Failed to load {self.token_path}: {e}")
+            return None
+
+    def _run_auth_flow(self):
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        flow = InstalledAppFlow.from_client_secrets_file(self.secrets_path, SCOPES)
+        return flow.run_local_server(port=0)
+
+    @staticmethod
+    def _expires_soon(creds):
+        if creds.expiry is None:
+            return False
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return creds.expiry - now < REFRESH_MARGIN
+
+
+# Shared by the CLI and the Flask app
+SERVICE_POOL = CalendarServicePool()
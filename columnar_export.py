@@ -0,0 +1,69 @@
+"""Parquet and Arrow export of time sheets, with native date, timestamp and duration columns.
+
+The rows are those of the time sheets the other formats print, for all clients in one table with a
+Client column. Date is a date, Start_time and End_time are UTC timestamps (all-day events, which have
+no time zone, are taken as UTC) and Day_total, Duration, Week_total (null without week totals) and
+Week_duration are durations, so no HH:MM strings need parsing back. Day is left out; it is part of Date.
+
+Arrow IPC files can be memory mapped and read without copying; Parquet files are smaller. A
+partitioned export is a directory in the Hive layout, Client=<name>/Month=<YYYY-MM>/, that pyarrow,
+pandas and most query engines read as one dataset. Rewriting it replaces only the months written.
+
+pyarrow is optional (pip install pyarrow) and is only imported when one of these formats is written.
+"""
+
+# Output format name -> pyarrow.dataset format name
+COLUMNAR_FORMATS = {'parquet': 'parquet', 'arrow': 'ipc'}
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("The parquet and arrow formats need pyarrow, install it with: pip install pyarrow") from None
+    return pyarrow
+
+
+def timesheet_schema():
+    pa = import_pyarrow()
+    return pa.schema([
+        ('Client', pa.string()),
+        ('Date', pa.date32()),
+        ('Day_total', pa.duration('us')),
+        ('Start_time', pa.timestamp('us', tz='UTC')),
+        ('End_time', pa.timestamp('us', tz='UTC')),
+        ('Duration', pa.duration('us')),
+        ('Week_nr', pa.string()),
+        ('Week_total', pa.duration('us')),
+        ('Week_duration', pa.duration('us')),
+        ('Description', pa.string()),
+    ])
+
+
+def timesheets_table(client_columns):
+    """Return a pyarrow Table of all time sheets from {client name: TimeSheetBuilder.columns()}."""
+    pa = import_pyarrow()
+    schema = timesheet_schema()
+    tables = []
+    for client_name, columns in client_columns.items():
+        data = dict(columns, Client=[client_name] * len(columns['Date']))
+        tables.append(pa.Table.from_pydict({name: data[name] for name in schema.names}, schema=schema))
+    return pa.concat_tables(tables) if tables else schema.empty_table()
+
+
+def write_table(table, path, file_format, partition=False):
+    """Write table to path as a 'parquet' or 'arrow' file, or as a directory partitioned by client and month."""
+    pa = import_pyarrow()
+    if partition:
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+        month = pc.strftime(table['Date'].cast(pa.timestamp('s')), format='%Y-%m')
+        ds.write_dataset(table.append_column('Month', month), path, format=COLUMNAR_FORMATS[file_format],
+                         partitioning=['Client', 'Month'], partitioning_flavor='hive',
+                         existing_data_behavior='delete_matching')
+    elif file_format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
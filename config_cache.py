@@ -0,0 +1,98 @@
+"""Parsed config.ini and clients.yaml, shared by the CLI, the Flask app and the background jobs.
+
+Each file is parsed once and kept in memory together with the structures derived from it. Every
+lookup stats the file and re-reads it only when its modification time or size has changed, so
+edits are still picked up without a restart while unchanged files are never parsed twice.
+"""
+import configparser
+import logging
+import os
+import threading
+
+import yaml
+
+
+class CachedFile:
+    """The result of parse(path), redone only when the file's mtime or size changes."""
+
+    def __init__(self, path, parse):
+        self.path = path
+        self.parse = parse
+        self._lock = threading.Lock()
+        self._signature = None
+        self._value = None
+        self._loaded = False
+
+    def get(self):
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            if not self._loaded or signature != self._signature:
+                # A file that fails to parse is not cached, so the next lookup tries again
+                self._value = self.parse(self.path)
+                self._signature = signature
+                self._loaded = True
+            return self._value
+
+
+class ClientConfig:
+    """clients.yaml, checked and with the lookups the app and the time sheets need precomputed."""
+
+    def __init__(self, data):
+        if not isinstance(data, dict) or not isinstance(data.get('Clients'), dict):
+            raise ValueError("clients.yaml must contain a 'Clients' mapping")
+        self.data = data
+        # Client name -> its settings; a client listed without settings gets an empty dict
+        self.clients = {name: client or {} for name, client in data['Clients'].items()}
+        self.client_list = list(self.clients)
+
+        self.choices = [(key, client.get('trade_name', key)) for key, client in self.clients.items()]
+        self.rates = {}
+        for key, client in self.clients.items():
+            try:
+                hourly_rate = float(client.get('hourly_rate', 90.0))
+            except (TypeError, ValueError):
+                raise ValueError(f"hourly_rate of client {key} in clients.yaml is not a number")
+            self.rates[key] = {'hourly_rate': hourly_rate, 'currency': client.get('currency', '€')}
+        # Client name -> the lower-case text its @tags are matched against (see TagRouter)
+        self.aliases = {key: str(client.get('alias_tag', key)).lower() for key, client in self.clients.items()}
+
+
+def parse_clients(path):
+    try:
+        with open(path, 'r') as file:
+            return ClientConfig(yaml.safe_load(file))
+    except Exception as e:
+        logging.error("Error reading %s: %s", path, str(e))
+        raise
+
+
+def parse_config(path):
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def _cached(path, parse):
+    key = (os.path.abspath(path), parse)
+    with _files_lock:
+        if key not in _files:
+            _files[key] = CachedFile(key[0], parse)
+        return _files[key]
+
+
+def load_clients(path='clients.yaml'):
+    """Return the ClientConfig of path. It is shared: callers must not modify it."""
+    return _cached(path, parse_clients).get()
+
+
+def load_config(path='config.ini'):
+    """Return config.ini as a ConfigParser. It is shared: callers must not modify it."""
+    return _cached(path, parse_config).get()
@@ -0,0 +1,273 @@
+import contextlib
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+
+from dateutil.parser import parse
+
+from calendar_service import EVENT_LIST_FIELDS
+
+# Largest page size the Calendar API accepts for events().list
+SYNC_PAGE_SIZE = 2500
+
+# The rollup index is kept per UTC day of the event start, numbered in days since the epoch
+ROLLUP_DAY_SECONDS = 86400
+
+# Seconds a write waits for another connection's write transaction (such as a rollup) to finish
+WRITE_TIMEOUT = 60
+
+
+def utc_timestamp(value):
+    """Return the epoch timestamp of a datetime, taking naive datetimes (all-day dates) as UTC."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.timestamp()
+
+
+def rollup_day(timestamp):
+    return int(timestamp // ROLLUP_DAY_SECONDS)
+
+
+def event_timestamp(event_time):
+    """Return a UTC epoch timestamp for an event 'start'/'end' dict (dateTime or all-day date)."""
+    value = event_time.get('dateTime', event_time.get('date'))
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        parsed = parse(value)
+    return utc_timestamp(parsed)
+
+
+class EventStore:
+    """On-disk cache of Google Calendar events, kept current with incremental (syncToken) sync.
+
+    Events are stored per calendar ID as the raw API resources. The first sync of a calendar
+    downloads everything; later syncs only transfer events changed since the stored sync token.
+    Several calendars may be synced from different threads; database access is serialized. Other
+    stores may use the same database file at the same time (the web app opens one per job); their
+    writes are serialized by SQLite, see transaction().
+
+    The store also holds a rollup index of per-client daily totals (see TimesheetGenerator.client_totals).
+    A rollup covers the configured calendars together, so events shared between them count once; it
+    is keyed by their comma separated IDs (its rollup_id), by a routing fingerprint, since the clients
+    an event counts for depend on the client list and tags, and by the UTC day the events start on.
+    Syncing a calendar drops the days of its changed events from every rollup, as any may include it.
+    """
+
+    def __init__(self, path='events.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=WRITE_TIMEOUT, check_same_thread=False)
+        self.lock = threading.RLock()
+        self._transaction_depth = 0
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                calendar_id TEXT NOT NULL,
+                event_id    TEXT NOT NULL,
+                start_ts    REAL NOT NULL,
+                end_ts      REAL NOT NULL,
+                data        TEXT NOT NULL,
+                PRIMARY KEY (calendar_id, event_id)
+            );
+            CREATE INDEX IF NOT EXISTS events_by_start ON events (calendar_id, start_ts);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                calendar_id TEXT PRIMARY KEY,
+                sync_token  TEXT,
+                synced_at   TEXT
+            );
+            CREATE TABLE IF NOT EXISTS rollup_days (
+                calendar_id TEXT NOT NULL,
+                routing     TEXT NOT NULL,
+                day         INTEGER NOT NULL,
+                PRIMARY KEY (calendar_id, routing, day)
+            );
+            CREATE TABLE IF NOT EXISTS rollup_totals (
+                calendar_id TEXT NOT NULL,
+                routing     TEXT NOT NULL,
+                day         INTEGER NOT NULL,
+                client      TEXT NOT NULL,
+                local_day   TEXT NOT NULL,
+                seconds     REAL NOT NULL,
+                events      INTEGER NOT NULL,
+                first_ts    REAL NOT NULL,
+                first_event TEXT NOT NULL,
+                first_rank  INTEGER NOT NULL,
+                PRIMARY KEY (calendar_id, routing, day, client, local_day)
+            );
+            CREATE INDEX IF NOT EXISTS rollup_days_by_day ON rollup_days (day);
+            CREATE INDEX IF NOT EXISTS rollup_totals_by_day ON rollup_totals (day);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Hold the lock and a write transaction (BEGIN IMMEDIATE), committed when the block ends.
+
+        The database is locked for writing from the start, so no other connection can change it
+        between the reads and writes of the block. Nested blocks join the outer transaction.
+        """
+        with self.lock:
+            if self._transaction_depth:
+                self._transaction_depth += 1
+                try:
+                    yield
+                finally:
+                    self._transaction_depth -= 1
+                return
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._transaction_depth = 1
+            try:
+                yield
+            except BaseException:
+                self.conn.rollback()
+                raise
+            else:
+                self.conn.commit()
+            finally:
+                self._transaction_depth = 0
+
+    def get_sync_token(self, cal_id):
+        with self.lock:
+            row = self.conn.execute("SELECT sync_token FROM sync_state WHERE calendar_id = ?", (cal_id,)).fetchone()
+        return row[0] if row else None
+
+    def has_calendar(self, cal_id):
+        return self.get_sync_token(cal_id) is not None
+
+    def clear(self, cal_id):
+        with self.transaction():
+            self.conn.execute("DELETE FROM events WHERE calendar_id = ?", (cal_id,))
+            self.conn.execute("DELETE FROM sync_state WHERE calendar_id = ?", (cal_id,))
+            # Every rollup may include the calendar; they are rebuilt when next used
+            self.conn.execute("DELETE FROM rollup_days")
+            self.conn.execute("DELETE FROM rollup_totals")
+
+    def sync(self, service, cal_id, time_zone=None, changes=None):
+        """Bring the stored events of cal_id up to date and return the number of changed events.
+
+        Uses the stored sync token when there is one and falls back to a full sync when the
+        server has expired it (HTTP 410 Gone). changes, when given a list, receives the changed
+        API events, cancelled ones included; after such a full sync it receives None instead,
+        as any stored event may have changed.
+        """
+        from googleapiclient.errors import HttpError
+        sync_token = self.get_sync_token(cal_id)
+        try:
+            return self._sync(service, cal_id, sync_token, time_zone, changes)
+        except HttpError as e:
+            if sync_token is None or e.resp.status != 410:
+                raise
+            logging.warning("Sync token for calendar %s expired, doing a full sync.", cal_id)
+            self.clear(cal_id)
+            if changes is not None:
+                changes.append(None)
+            return self._sync(service, cal_id, None, time_zone)
+
+    def _sync(self, service, cal_id, sync_token, time_zone, changes=None):
+        if sync_token is None:
+            logging.info("Full sync of calendar %s into %s", cal_id, self.path)
+        params = {'calendarId': cal_id, 'maxResults': SYNC_PAGE_SIZE, 'singleEvents': True,
+                  'fields': EVENT_LIST_FIELDS}
+        if time_zone:
+            params['timeZone'] = time_zone
+        if sync_token:
+            params['syncToken'] = sync_token
+
+        changed = 0
+        page_token = None
+        while True:
+            page = service.events().list(pageToken=page_token, **params).execute()
+            items = page.get('items', [])
+            self._apply(cal_id, items)
+            changed += len(items)
+            if changes is not None:
+                changes.extend(items)
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                break
+
+        with self.transaction():
+            self.conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                              (cal_id, page.get('nextSyncToken'),
+                               datetime.datetime.now(datetime.timezone.utc).isoformat()))
+        logging.info("Synced %d changed events for calendar %s", changed, cal_id)
+        return changed
+
+    def _apply(self, cal_id, items):
+        upserts = []
+        deletes = []
+        for event in items:
+            if event.get('status') == 'cancelled' or 'start' not in event:
+                deletes.append((cal_id, event['id']))
+            else:
+                upserts.append((cal_id, event['id'], event_timestamp(event['start']),
+                                event_timestamp(event['end']), json.dumps(event)))
+        with self.transaction():
+            self._invalidate_rollup(cal_id, items, upserts)
+            self.conn.executemany("DELETE FROM events WHERE calendar_id = ? AND event_id = ?", deletes)
+            self.conn.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)", upserts)
+
+    def _invalidate_rollup(self, cal_id, items, upserts):
+        """Drop the rollup days an event started on before the change and starts on after it, from every rollup."""
+        if self.conn.execute("SELECT 1 FROM rollup_days LIMIT 1").fetchone() is None:
+            return
+        days = {rollup_day(start_ts) for _, _, start_ts, _, _ in upserts}
+        for event in items:
+            row = self.conn.execute("SELECT start_ts FROM events WHERE calendar_id = ? AND event_id = ?",
+                                    (cal_id, event['id'])).fetchone()
+            if row:
+                days.add(rollup_day(row[0]))
+        params = [(day,) for day in days]
+        self.conn.executemany("DELETE FROM rollup_days WHERE day = ?", params)
+        self.conn.executemany("DELETE FROM rollup_totals WHERE day = ?", params)
+
+    def get_events(self, cal_id, start_date, end_date):
+        """Yield the stored events of cal_id overlapping [start_date, end_date), ordered by start time.
+
+        Naive datetimes are taken as UTC, matching the timeMin/timeMax sent to the API. The rows are
+        read under the lock, as the connection is shared with syncs running in other threads.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT data FROM events WHERE calendar_id = ? AND end_ts > ? AND start_ts < ? "
+                "ORDER BY start_ts, event_id", (cal_id, utc_timestamp(start_date), utc_timestamp(end_date))).fetchall()
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def get_events_starting(self, cal_id, start_ts, end_ts):
+        """Return (start_ts, event_id, event) of the stored events of cal_id starting in [start_ts, end_ts), ordered by start time."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT start_ts, event_id, data FROM events WHERE calendar_id = ? AND start_ts >= ? AND start_ts < ? "
+                "ORDER BY start_ts, event_id", (cal_id, start_ts, end_ts)).fetchall()
+        return [(start_ts, event_id, json.loads(data)) for start_ts, event_id, data in rows]
+
+    def missing_rollup_days(self, rollup_id, routing, first_day, end_day):
+        """Return the days in [first_day, end_day) that have no rollup for these calendars and routing yet."""
+        with self.lock:
+            done = {day for (day,) in self.conn.execute(
+                "SELECT day FROM rollup_days WHERE calendar_id = ? AND routing = ? AND day >= ? AND day < ?",
+                (rollup_id, routing, first_day, end_day))}
+        return [day for day in range(first_day, end_day) if day not in done]
+
+    def put_rollup(self, rollup_id, routing, days, rows):
+        """Store the rollup of days: rows of (day, client, local_day, seconds, events, first_ts, first_event, first_rank).
+
+        Days without rows are stored as having no tagged events.
+        """
+        with self.transaction():
+            self.conn.executemany("INSERT OR REPLACE INTO rollup_days VALUES (?, ?, ?)",
+                                  [(rollup_id, routing, day) for day in days])
+            self.conn.executemany("INSERT OR REPLACE INTO rollup_totals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  [(rollup_id, routing) + tuple(row) for row in rows])
+
+    def get_rollup(self, rollup_id, routing, first_day, end_day):
+        """Return the rollup rows of the days in [first_day, end_day), as stored by put_rollup."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT day, client, local_day, seconds, events, first_ts, first_event, first_rank FROM rollup_totals "
+                "WHERE calendar_id = ? AND routing = ? AND day >= ? AND day < ?",
+                (rollup_id, routing, first_day, end_day)).fetchall()
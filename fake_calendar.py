@@ -0,0 +1,205 @@
+"""In-memory stand-in for the Google Calendar API service returned by build('calendar', 'v3').
+
+Supports the parts of events().list used by this project: paging, timeMin/timeMax filtering,
+orderBy='startTime', incremental sync tokens and partial responses (the fields parameter), so
+the fetch and sync code can be exercised without a Google account. Response sizes are counted
+in the same TransferStats as the real service pool, as if they were sent gzipped. With
+require_fields it also checks that every list call asks for a mask keeping REQUIRED_FIELDS.
+"""
+import contextlib
+import datetime
+import gzip
+import json
+import time
+
+import httplib2
+from dateutil.parser import parse
+from googleapiclient.errors import HttpError
+
+from calendar_service import TransferStats
+
+# The parts of an events().list response the project reads; with require_fields, masks must keep them.
+# An empty dict means the whole field: a mask selecting only part of it (start/dateTime) drops the rest.
+REQUIRED_FIELDS = {
+    'nextPageToken': {},
+    'nextSyncToken': {},
+    'items': {'id': {}, 'status': {}, 'summary': {}, 'start': {}, 'end': {}},
+}
+
+
+def _timestamp(value):
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        parsed = parse(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def _event_ts(event_time):
+    return _timestamp(event_time.get('dateTime', event_time.get('date')))
+
+
+def parse_field_mask(fields):
+    """Parse a partial response mask such as 'nextPageToken,items(id,start/dateTime)' into nested dicts."""
+    tree = {}
+    stack = [tree]
+    node = tree
+    name = ''
+    for char in fields + ',':
+        if char in ',()':
+            if name.strip():
+                node = stack[-1]
+                for part in name.strip().split('/'):
+                    node = node.setdefault(part, {})
+            name = ''
+            if char == '(':
+                stack.append(node)
+            elif char == ')':
+                stack.pop()
+        else:
+            name += char
+    return tree
+
+
+def missing_fields(tree, required=REQUIRED_FIELDS, prefix=''):
+    """Return the paths of the required fields that a parsed field mask leaves out, or only partly selects."""
+    missing = []
+    for name, required_parts in required.items():
+        if name not in tree:
+            missing.append(prefix + name)
+        elif tree[name]:
+            if required_parts:
+                missing += missing_fields(tree[name], required_parts, f'{prefix}{name}/')
+            else:
+                missing.append(prefix + name)
+    return missing
+
+
+def apply_field_mask(value, tree):
+    """Keep only the parts of a response selected by a parsed field mask (an empty mask keeps everything)."""
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [apply_field_mask(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: apply_field_mask(item, tree[key]) for key, item in value.items() if key in tree}
+    return value
+
+
+class _Request:
+    def __init__(self, func, latency=0.0):
+        self._func = func
+        self._latency = latency
+
+    def execute(self):
+        if self._latency:
+            time.sleep(self._latency)
+        return self._func()
+
+
+class FakeCalendarService:
+    def __init__(self, events=None, cal_id='primary', latency=0.0, require_fields=False):
+        # calendar ID -> event ID -> (version, event); cancelled events are kept as tombstones
+        self.calendars = {}
+        self.version = 0
+        self.requests = []
+        # Seconds every events().list page takes, to simulate the network round trip
+        self.latency = latency
+        # Reject events().list calls without a fields mask, or with one leaving out REQUIRED_FIELDS, to check
+        # that callers ask for partial responses that still hold everything they read
+        self.require_fields = require_fields
+        self.stats = TransferStats()
+        for event in events or []:
+            self.put_event(cal_id, event)
+
+    def put_event(self, cal_id, event):
+        """Insert or update an event, marking it as changed for incremental sync."""
+        self.version += 1
+        self.calendars.setdefault(cal_id, {})[event['id']] = (self.version, event)
+
+    def delete_event(self, cal_id, event_id):
+        self.put_event(cal_id, {'id': event_id, 'status': 'cancelled'})
+
+    def events(self):
+        return _FakeEvents(self)
+
+    def calendarList(self):
+        return _FakeCalendarList(self)
+
+
+class FakeServicePool:
+    """Drop-in for calendar_service.CalendarServicePool that always hands out the same fake service."""
+
+    def __init__(self, service):
+        self.fake_service = service
+        self.stats = service.stats
+
+    def get_credentials(self):
+        return None
+
+    @contextlib.contextmanager
+    def service(self):
+        yield self.fake_service
+
+
+class _FakeCalendarList:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, **kwargs):
+        items = [{'id': cal_id, 'summary': cal_id} for cal_id in self.service.calendars]
+        return _Request(lambda: {'items': items})
+
+
+class _FakeEvents:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, calendarId, maxResults=250, pageToken=None, syncToken=None, timeMin=None,
+             timeMax=None, orderBy=None, fields=None, **kwargs):
+        service = self.service
+        service.requests.append(dict(calendarId=calendarId, maxResults=maxResults, pageToken=pageToken,
+                                     syncToken=syncToken, timeMin=timeMin, timeMax=timeMax,
+                                     orderBy=orderBy, fields=fields, **kwargs))
+
+        def execute():
+            if service.require_fields:
+                if not fields:
+                    raise HttpError(httplib2.Response({'status': 400}), b'{"error": "fields mask required"}')
+                missing = missing_fields(parse_field_mask(fields))
+                if missing:
+                    raise HttpError(httplib2.Response({'status': 400}),
+                                    json.dumps({'error': f"fields mask leaves out {', '.join(missing)}"}).encode())
+            stored = service.calendars.get(calendarId, {})
+            if syncToken is not None:
+                if not syncToken.startswith('v') or int(syncToken[1:]) > service.version:
+                    raise HttpError(httplib2.Response({'status': 410}), b'{"error": "fullSyncRequired"}')
+                since = int(syncToken[1:])
+                items = [event for version, event in stored.values() if version > since]
+            else:
+                items = [event for _, event in stored.values() if event.get('status') != 'cancelled']
+                if timeMin:
+                    min_ts = _timestamp(timeMin)
+                    items = [e for e in items if _event_ts(e['end']) > min_ts]
+                if timeMax:
+                    max_ts = _timestamp(timeMax)
+                    items = [e for e in items if _event_ts(e['start']) < max_ts]
+                if orderBy == 'startTime':
+                    items.sort(key=lambda e: _event_ts(e['start']))
+
+            offset = int(pageToken or 0)
+            response = {'kind': 'calendar#events', 'items': items[offset:offset + maxResults]}
+            if offset + maxResults < len(items):
+                response['nextPageToken'] = str(offset + maxResults)
+            else:
+                response['nextSyncToken'] = f"v{service.version}"
+            if fields:
+                response = apply_field_mask(response, parse_field_mask(fields))
+            # Round-trip through JSON so callers never share objects with the fake's state
+            payload = json.dumps(response).encode('utf-8')
+            service.stats.add(len(gzip.compress(payload, compresslevel=6)), len(payload))
+            return json.loads(payload)
+
+        return _Request(execute, service.latency)
@@ -0,0 +1,84 @@
+"""Invoice and timesheet page contents, shared by the web form (app.py) and the batch invoicing CLI.
+
+The functions here return template variables; rendering is left to the caller, which is Flask's
+render_template in the app and a plain jinja2 environment over the same templates in the CLI.
+"""
+import os
+from datetime import timedelta
+
+# All possible timesheet columns: (DataFrame column name, form field name, fixed PDF width)
+# Width is sized to fit header text without wrapping at 9pt Arial; None = Description takes remaining space.
+TIMESHEET_COLUMNS = [
+    ('Date',          'col_date',          '2.3cm'),
+    ('Day_total',     'col_day_total',      '2.0cm'),
+    ('Day',           'col_day',            '1.0cm'),
+    ('Start_time',    'col_start_time',     '2.3cm'),
+    ('End_time',      'col_end_time',       '2.1cm'),
+    ('Duration',      'col_duration',       '2.0cm'),
+    ('Week_total',    'col_week_total',     '2.2cm'),
+    ('Week_nr',       'col_week_nr',        '1.7cm'),
+    ('Week_duration', 'col_week_duration',  '2.6cm'),
+    ('Description',   'col_description',    None),
+]
+
+# Columns of the appended timesheet pages when none are chosen, as in the form's defaults
+DEFAULT_TIMESHEET_COLUMNS = ['col_date', 'col_duration', 'col_description']
+
+
+def invoice_context(client_name, client_config, totals, invoice_number, invoice_date):
+    """Return the invoice.html variables of one client, billing the hours of its ClientTotals."""
+    client_data = client_config.clients[client_name]
+    rate = client_config.rates[client_name]
+    client_reg_name = client_data.get('registration_name', client_name)
+
+    total_hours, remainder = divmod(totals.total_duration.total_seconds(), 3600)
+    total_minutes = remainder / 3600  # Convert minutes to decimal hours
+    total_hours_decimal = total_hours + total_minutes
+
+    start_week, end_week = totals.week_range()
+    first_day = totals.first_day.strftime('%d-%m-%Y')
+    last_day = totals.last_day.strftime('%d-%m-%Y')
+
+    hourly_rate = rate['hourly_rate']
+    currency = rate['currency']
+    total_price = total_hours_decimal * hourly_rate
+    price_str = f"{hourly_rate:.2f}".replace('.', ',')
+
+    return {
+        'client': client_data,
+        'invoice_number': invoice_number,
+        'invoice_date': invoice_date.strftime('%d-%m-%Y'),
+        'due_date': (invoice_date + timedelta(days=30)).strftime('%d-%m-%Y'),
+        'reference': 'Georges Meinders',
+        'items': [{
+            'quantity': f'{total_hours_decimal:.2f} hours',
+            'description': f'Delivered engineering services to {client_reg_name} for week {start_week} up to and including week {end_week} ({first_day} up to and including {last_day}).',
+            'price': price_str,
+            'total': f'{total_price:.2f}',
+            'vat_rate': '0,00'
+        }],
+        'vat_calculation_text': f'0.00% VAT on {currency} {total_price:.2f} = {currency} 0,00',
+        'total_amount': f'{currency} {total_price:.2f}',
+        'logo_path': os.path.abspath('templates/logo.jpg'),
+    }
+
+
+def timesheet_pdf_context(timesheet, selected_columns):
+    """Return the timesheet_pdf.html variables of one client with the selected form columns (all when none match)."""
+    timesheet_df = timesheet.time_sheet_df
+    # Build filtered column list (name, width) based on selected checkboxes
+    selected_col_info = [
+        (col, width) for col, field_name, width in TIMESHEET_COLUMNS
+        if field_name in selected_columns and col in timesheet_df.columns
+    ] or [(col, width) for col, _, width in TIMESHEET_COLUMNS
+          if col in timesheet_df.columns]
+    selected_cols = [col for col, _ in selected_col_info]
+    filtered_df = timesheet_df[selected_cols]
+
+    return {
+        'client_name': timesheet.client_name,
+        'first_day': timesheet_df.iloc[0]['Date'],
+        'last_day': timesheet_df.iloc[-1]['Date'],
+        'timesheet_cols': [{'name': col, 'width': width} for col, width in selected_col_info],
+        'timesheet_rows': filtered_df.fillna('').values.tolist(),
+    }
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import PROFILER
+
+
+class Job:
+    """A unit of background work with per-stage progress that can be polled as JSON."""
+
+    def __init__(self, stages):
+        self.id = uuid.uuid4().hex
+        self.state = 'queued'
+        self.stages = {name: {'state': 'pending', 'done': 0, 'total': None} for name in stages}
+        self.error = None
+        self.result = None
+        # Profiling spans finished while the job ran (empty unless profiling is enabled)
+        self.spans = []
+        self.created = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def start_stage(self, name, total=None):
+        with self._lock:
+            self.stages[name].update(state='running', total=total)
+
+    def advance(self, name, done, total=None):
+        with self._lock:
+            self.stages[name]['done'] = done
+            if total is not None:
+                self.stages[name]['total'] = total
+
+    def finish_stage(self, name):
+        with self._lock:
+            stage = self.stages[name]
+            stage['state'] = 'done'
+            if stage['total'] is None:
+                stage['total'] = stage['done']
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'state': self.state,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'error': self.error,
+            }
+
+
+class JobRegistry:
+    """Runs jobs on a small thread pool and keeps them around for polling.
+
+    Only the most recent max_finished finished jobs are kept; older ones are forgotten.
+    """
+
+    def __init__(self, max_workers=2, max_finished=50):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.max_finished = max_finished
+
+    def submit(self, func, *args, stages=()):
+        """Queue func(job, *args) and return the Job immediately; its return value becomes job.result."""
+        job = Job(stages)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @staticmethod
+    def _run(job, func, args):
+        job.state = 'running'
+        try:
+            with PROFILER.collect() as job.spans:
+                job.result = func(job, *args)
+            job.state = 'done'
+        except Exception as e:
+            logging.exception("Job %s failed", job.id)
+            job.error = str(e)
+            job.state = 'failed'
+        finally:
+            job.finished = time.time()
+
+    def _prune(self):
+        finished = sorted((job for job in self._jobs.values() if job.finished is not None),
+                          key=lambda job: job.finished)
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.id]
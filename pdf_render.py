@@ -0,0 +1,230 @@
+import contextlib
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from xhtml2pdf import pisa
+
+PDF_CACHE_DIR = 'pdf_cache'
+PDF_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class PdfRenderError(Exception):
+    pass
+
+
+class PdfCache:
+    """Size-bounded on-disk LRU cache of rendered PDFs, keyed by a hash of the source HTML.
+
+    Entries are plain files named after the hash, so worker processes share the cache. A hit
+    bumps the file's mtime; when the directory grows past max_bytes the oldest entries are removed.
+    """
+
+    def __init__(self, directory=PDF_CACHE_DIR, max_bytes=PDF_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, html):
+        return os.path.join(self.directory, hashlib.sha256(html.encode('utf-8')).hexdigest() + '.pdf')
+
+    def get(self, html):
+        path = self._path(html)
+        try:
+            with open(path, 'rb') as f:
+                pdf = f.read()
+            os.utime(path)
+            return pdf
+        except FileNotFoundError:
+            return None
+
+    def copy_to(self, html, path):
+        """Copy the cached PDF of html to path; return False when it is not cached."""
+        source = self._path(html)
+        try:
+            shutil.copyfile(source, path)
+            os.utime(source)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, html, pdf):
+        self._store(html, lambda f: f.write(pdf))
+
+    def put_file(self, html, path):
+        """Cache the PDF of html that has been written to path."""
+        def copy(f):
+            with open(path, 'rb') as source:
+                shutil.copyfileobj(source, f)
+        self._store(html, copy)
+
+    def _store(self, html, write):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first so other processes never read a partial PDF
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, self._path(html))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pdf'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+PDF_CACHE = PdfCache()
+
+
+def render_pdf(html, cache=PDF_CACHE, path=None):
+    """Render an HTML document to PDF with xhtml2pdf, reusing a cached render of the same HTML.
+
+    Returns the PDF bytes or, when path is given, writes the PDF straight to that file and returns path.
+    """
+    if cache is not None:
+        if path is None:
+            pdf = cache.get(html)
+            if pdf is not None:
+                return pdf
+        elif cache.copy_to(html, path):
+            return path
+
+    if path is None:
+        buffer = io.BytesIO()
+        _create_pdf(html, buffer)
+        pdf = buffer.getvalue()
+        if cache is not None:
+            cache.put(html, pdf)
+        return pdf
+
+    try:
+        with open(path, 'wb') as f:
+            _create_pdf(html, f)
+    except Exception:
+        # Never leave a partial PDF behind
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        raise
+    if cache is not None:
+        cache.put_file(html, path)
+    return path
+
+
+def _create_pdf(html, dest):
+    status = pisa.CreatePDF(html, dest=dest, encoding='utf-8')
+    if status.err:
+        raise PdfRenderError(f"xhtml2pdf reported {status.err} error(s)")
+
+
+_STYLE_PATTERN = re.compile(r'<style\b.*?</style>', re.IGNORECASE | re.DOTALL)
+_BODY_PATTERN = re.compile(r'<body\b[^>]*>(.*)</body>', re.IGNORECASE | re.DOTALL)
+
+
+def combine_html(invoice_html, timesheet_html):
+    """Return one document holding the invoice pages followed by the timesheet pages.
+
+    The timesheet's styles are added to the invoice's head and its body is placed after the
+    invoice's, behind a switch to the 'timesheet' page template (A4 landscape, defined by
+    timesheet_pdf.html), so xhtml2pdf lays out both in a single pass. The timesheet styles are
+    scoped to its own elements and leave the invoice alone.
+    """
+    styles = ''.join(_STYLE_PATTERN.findall(timesheet_html))
+    body = _BODY_PATTERN.search(timesheet_html)
+    pages = '<pdf:nexttemplate name="timesheet" /><pdf:nextpage />' + (body.group(1) if body else timesheet_html)
+
+    lower = invoice_html.lower()
+    head_end = lower.find('</head>')
+    body_end = lower.rfind('</body>')
+    if body_end == -1:
+        body_end = len(invoice_html)
+    if head_end == -1 or head_end > body_end:
+        return styles + invoice_html[:body_end] + pages + invoice_html[body_end:]
+    return (invoice_html[:head_end] + styles + invoice_html[head_end:body_end] + pages
+            + invoice_html[body_end:])
+
+
+def render_client_pdf(invoice_html, timesheet_html=None, path=None):
+    """Render a client's invoice (portrait) followed by its timesheet (landscape), if given, as one PDF.
+
+    Returns the PDF bytes, or path after writing the PDF there (see render_pdf).
+    """
+    html = invoice_html if timesheet_html is None else combine_html(invoice_html, timesheet_html)
+    try:
+        return render_pdf(html, path=path)
+    except PdfRenderError as e:
+        raise PdfRenderError(f"Error generating PDF invoice: {e}") from e
+
+
+# xhtml2pdf is CPU-bound, so client PDFs are rendered in worker processes shared by all requests
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def render_client_pdfs(jobs, paths=None, progress=None):
+    """Render (invoice_html, timesheet_html) jobs in parallel, one worker process per job.
+
+    Returns a list in job order holding, per job, the PDF bytes or the exception that job raised,
+    so one failing client does not abort the others. With paths (one per job), each worker writes
+    its PDF straight to its file and the result is the path. progress(done, total) is called as
+    jobs complete.
+    """
+    paths = paths or [None] * len(jobs)
+    results = [None] * len(jobs)
+
+    if len(jobs) == 1 or (os.cpu_count() or 1) == 1:
+        # Nothing to parallelize; skip the round trip through a worker process
+        for index, job in enumerate(jobs):
+            try:
+                results[index] = render_client_pdf(*job, path=paths[index])
+            except Exception as e:
+                results[index] = e
+            if progress:
+                progress(index + 1, len(jobs))
+        return results
+
+    executor = _get_executor()
+    futures = {executor.submit(render_client_pdf, *job, path=paths[index]): index for index, job in enumerate(jobs)}
+    for done, future in enumerate(as_completed(futures), start=1):
+        try:
+            results[futures[future]] = future.result()
+        except BrokenProcessPool as e:
+            _reset_executor()
+            results[futures[future]] = e
+        except Exception as e:
+            results[futures[future]] = e
+        if progress:
+            progress(done, len(jobs))
+    return results
@@ -0,0 +1,214 @@
+"""Lightweight timing spans for the time sheet pipeline.
+
+Stages are wrapped in ``with PROFILER.span('name') as span:``. Nothing is recorded until
+PROFILER.enable() is called; until then span() hands out a shared no-op object, so instrumented
+code costs one attribute check per stage. Enabled spans record wall time, an optional item count
+(set span.count) and, with memory tracing on, the peak traced memory above the level at which the
+span started. tracemalloc is process-wide, so peaks of spans running concurrently on several
+threads overlap.
+
+Finished spans are added to per-stage histograms (see metrics_text) and handed to the collectors
+active on the finishing thread (see collect).
+"""
+import bisect
+import contextlib
+import itertools
+import threading
+import time
+import tracemalloc
+
+# Upper bounds in seconds of the stage duration histogram buckets, in the Prometheus convention
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _NullSpan:
+    __slots__ = ('count',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ('profiler', 'name', 'count', 'depth', 'seconds', 'peak_bytes',
+                 'start', '_start_memory', '_child_peak')
+
+    def __init__(self, profiler, name, count=None):
+        self.profiler = profiler
+        self.name = name
+        self.count = count
+        self.depth = 0
+        self.start = None
+        self.seconds = None
+        self.peak_bytes = None
+        self._start_memory = 0
+        self._child_peak = 0
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        self.depth = len(stack)
+        stack.append(self)
+        if self.profiler.trace_memory:
+            self._start_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        stack = self.profiler._stack()
+        stack.pop()
+        if self.profiler.trace_memory and tracemalloc.is_tracing():
+            # A nested span resets the peak, so the highest peak of the children is carried up
+            peak = max(tracemalloc.get_traced_memory()[1], self._child_peak)
+            self.peak_bytes = peak - self._start_memory
+            if stack:
+                stack[-1]._child_peak = max(stack[-1]._child_peak, peak)
+        self.profiler._record(self)
+        return False
+
+    def to_dict(self):
+        return {'name': self.name, 'seconds': self.seconds, 'count': self.count,
+                'peak_bytes': self.peak_bytes, 'depth': self.depth}
+
+
+class Histogram:
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """Return [(upper bound, observations <= bound)], ending with ('+Inf', count)."""
+        return list(zip(list(self.buckets) + ['+Inf'], itertools.accumulate(self.counts)))
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self._durations = {}
+        self._items = {}
+        self._peaks = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, trace_memory=True):
+        self.enabled = True
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = False
+
+    def span(self, name, count=None):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, count)
+
+    def start_collecting(self):
+        """Start collecting the spans that finish on this thread into a new list and return it."""
+        spans = []
+        self._collectors().append(spans)
+        return spans
+
+    def stop_collecting(self, spans):
+        collectors = self._collectors()
+        if any(collector is spans for collector in collectors):
+            collectors.remove(spans)
+
+    @contextlib.contextmanager
+    def collect(self):
+        spans = self.start_collecting()
+        try:
+            yield spans
+        finally:
+            self.stop_collecting(spans)
+
+    def metrics_text(self):
+        """Return the per-stage histograms in the Prometheus text exposition format."""
+        with self._lock:
+            durations = dict(self._durations)
+            items = dict(self._items)
+            peaks = dict(self._peaks)
+
+        lines = ['# HELP timesheeter_stage_seconds Wall time of time sheet pipeline stages.',
+                 '# TYPE timesheeter_stage_seconds histogram']
+        for name, histogram in sorted(durations.items()):
+            for bound, count in histogram.cumulative_counts():
+                lines.append(f'timesheeter_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'timesheeter_stage_seconds_sum{{stage="{name}"}} {histogram.sum}')
+            lines.append(f'timesheeter_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+        lines += ['# HELP timesheeter_stage_items_total Items (events, rows, PDFs) handled by each stage.',
+                  '# TYPE timesheeter_stage_items_total counter']
+        lines += [f'timesheeter_stage_items_total{{stage="{name}"}} {count}' for name, count in sorted(items.items())]
+        lines += ['# HELP timesheeter_stage_peak_bytes Highest peak traced memory seen in each stage.',
+                  '# TYPE timesheeter_stage_peak_bytes gauge']
+        lines += [f'timesheeter_stage_peak_bytes{{stage="{name}"}} {peak}' for name, peak in sorted(peaks.items())]
+        return '\n'.join(lines) + '\n'
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _collectors(self):
+        try:
+            return self._local.collectors
+        except AttributeError:
+            self._local.collectors = []
+            return self._local.collectors
+
+    def _record(self, span):
+        with self._lock:
+            self._durations.setdefault(span.name, Histogram()).observe(span.seconds)
+            if span.count is not None:
+                self._items[span.name] = self._items.get(span.name, 0) + span.count
+            if span.peak_bytes is not None:
+                self._peaks[span.name] = max(self._peaks.get(span.name, 0), span.peak_bytes)
+        for collector in self._collectors():
+            collector.append(span)
+
+
+def format_summary(spans):
+    """Return a table of spans in the order they started, nested spans indented under their parent."""
+    from tabulate import tabulate
+    # Spans finish innermost first; order by start so parents come before their children
+    rows = [['  ' * span.depth + span.name,
+             f'{span.seconds * 1e3:.1f}',
+             '' if span.count is None else span.count,
+             '' if span.peak_bytes is None else f'{span.peak_bytes / 2 ** 20:.1f}']
+            for span in sorted(spans, key=lambda span: span.start)]
+    return tabulate(rows, headers=['Stage', 'Time (ms)', 'Items', 'Peak memory (MiB)'], tablefmt='presto')
+
+
+def server_timing(spans):
+    """Return a Server-Timing header value for spans, e.g. 'fetch;dur=12.3;desc="400 items"'."""
+    metrics = []
+    for span in spans:
+        metric = f'{span.name};dur={span.seconds * 1e3:.1f}'
+        if span.count is not None:
+            metric += f';desc="{span.count} items"'
+        metrics.append(metric)
+    return ', '.join(metrics)
+
+
+# Shared by the CLI and the Flask app
+PROFILER = Profiler()
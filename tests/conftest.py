@@ -0,0 +1,50 @@
+"""Shared fixtures: a working directory with config.ini and clients.yaml, and generators on fake calendars."""
+import pytest
+
+from fake_calendar import FakeCalendarService, FakeServicePool
+from TimeSheeter import TimesheetGenerator
+
+CLIENTS_YAML = """\
+Clients:
+  Acme:
+    alias_tag: AcmeCorp
+    hourly_rate: 95
+  Foo:
+    alias_tag: FooBar
+    hourly_rate: 80
+  Globex:
+    hourly_rate: 100
+"""
+
+
+def event(event_id, start, end, summary):
+    """Return a Calendar API event; start and end are ISO datetimes, or dates for all-day events."""
+    key = 'date' if len(start) == 10 else 'dateTime'
+    return {'id': event_id, 'status': 'confirmed', 'summary': summary, 'start': {key: start}, 'end': {key: end}}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'clients.yaml').write_text(CLIENTS_YAML)
+    return tmp_path
+
+
+@pytest.fixture
+def make_generator(workdir):
+    """Return make(calendars, **kwargs) -> (TimesheetGenerator, FakeCalendarService).
+
+    calendars maps calendar IDs to their events, in the order config.ini lists them. The fake checks
+    the field mask of every list call; the event store is kept in the working directory.
+    """
+    def make(calendars, **kwargs):
+        service = FakeCalendarService(require_fields=True)
+        for cal_id, events in calendars.items():
+            service.calendars.setdefault(cal_id, {})
+            for calendar_event in events:
+                service.put_event(cal_id, calendar_event)
+        (workdir / 'config.ini').write_text(
+            f"[Google Calendar]\nCalID = {','.join(calendars)}\n\n[Event Store]\nPath = events.db\n")
+        return TimesheetGenerator(service_pool=FakeServicePool(service), **kwargs), service
+
+    return make
@@ -0,0 +1,23 @@
+"""EventStore reads against syncs of the same store."""
+import datetime
+
+from conftest import event
+from event_store import EventStore
+
+START = datetime.datetime(2024, 1, 1)
+END = datetime.datetime(2024, 2, 1)
+
+
+def test_reading_events_is_not_changed_by_a_sync_in_between(tmp_path):
+    store = EventStore(str(tmp_path / 'events.db'))
+    items = [event(f'e{day:02d}', f'2024-01-{day:02d}T09:00:00+01:00', f'2024-01-{day:02d}T10:00:00+01:00',
+                   '@acme work') for day in range(1, 11)]
+    store._apply('cal', items)
+
+    events = store.get_events('cal', START, END)
+    assert next(events)['id'] == 'e01'
+    # A sync in another thread shares the connection; the events read are those of the query
+    store._apply('cal', [dict(item, status='cancelled') for item in items[5:]])
+    assert [item['id'] for item in events] == [item['id'] for item in items[1:]]
+    assert [item['id'] for item in store.get_events('cal', START, END)] == [item['id'] for item in items[:5]]
+    store.close()
@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+
+from conftest import event
+from TimeSheeter import CalendarEvent, TimesheetGenerator, main
+
+START = datetime.datetime(2024, 3, 1)
+END = datetime.datetime(2024, 3, 31, 23, 59, 59)
+
+
+def calendar_events(*events):
+    return [CalendarEvent.from_api(item) for item in events]
+
+
+def test_merge_yields_shared_events_once_whatever_the_order_of_ties():
+    shared = event('zz-shared', '2024-03-04T09:00:00+01:00', '2024-03-04T10:00:00+01:00', '@acme standup')
+    own = event('aa-own', '2024-03-04T09:00:00+01:00', '2024-03-04T11:00:00+01:00', '@acme review')
+    later = event('later', '2024-03-05T09:00:00+01:00', '2024-03-05T10:00:00+01:00', '@acme later')
+    merged = TimesheetGenerator.merge_event_streams([calendar_events(shared, own, later), calendar_events(shared)])
+    assert sorted(item.id for item in merged) == ['aa-own', 'later', 'zz-shared']
+
+
+def test_no_cache_fetch_of_several_calendars_counts_a_shared_event_once(make_generator):
+    shared = event('zz-shared', '2024-03-04T09:00:00+01:00', '2024-03-04T10:00:00+01:00', '@acme standup')
+    own = event('aa-own', '2024-03-04T09:00:00+01:00', '2024-03-04T11:00:00+01:00', '@acme review')
+    # The fake returns events starting at the same time in insertion order, so calA has zz before aa
+    generator, _ = make_generator({'calA': [shared, own], 'calB': [shared]}, use_event_store=False)
+    assert sorted(item.id for item in generator.get_gcal_events(START, END)) == ['aa-own', 'zz-shared']
+
+
+def test_windowed_fetch_yields_an_event_spanning_windows_once(make_generator):
+    # Both start at the same time; the first also overlaps the March window
+    spanning = event('zz-span', '2024-02-29T23:00:00+01:00', '2024-03-01T02:00:00+01:00', '@acme release')
+    other = event('aa-other', '2024-02-29T23:00:00+01:00', '2024-02-29T23:30:00+01:00', '@acme check')
+    generator, service = make_generator({'primary': [spanning, other]}, use_event_store=False)
+    events = list(generator.get_gcal_events(datetime.datetime(2024, 2, 1), END))
+    assert len([request for request in service.requests if request['timeMin']]) == 2
+    assert sorted(item.id for item in events) == ['aa-other', 'zz-span']
+
+
+def test_no_cache_fetch_of_several_calendars_is_merged_as_pages_arrive(make_generator, monkeypatch):
+    monkeypatch.setattr('TimeSheeter.EVENTS_PAGE_SIZE', 2)
+    calendars = {cal_id: [event(f'{cal_id}-{day:02d}', f'2024-03-{day:02d}T{hour}:00:00+01:00',
+                                f'2024-03-{day:02d}T{hour}:30:00+01:00', '@acme work') for day in range(1, 21)]
+                 for cal_id, hour in (('calA', '09'), ('calB', '10'))}
+    generator, service = make_generator(calendars, use_event_store=False, window_days=0)
+    events = generator.get_gcal_events(START, END)
+    assert next(events).id == 'calA-01'
+    # Each calendar is at most a few pages ahead of the merge, out of ten
+    for cal_id in calendars:
+        assert 1 <= len([request for request in service.requests if request['calendarId'] == cal_id]) <= 4
+    assert [item.id for item in events] == [f'{cal_id}-{day:02d}' for day in range(1, 21) for cal_id in calendars][1:]
+
+
+def test_windowed_fetch_yields_events_before_the_last_window_is_fetched(make_generator):
+    monthly = [event(f'{year}-{month:02d}', f'{year}-{month:02d}-10T09:00:00+01:00', f'{year}-{month:02d}-10T10:00:00+01:00',
+                     '@acme report') for year in (2023, 2024) for month in range(1, 13)]
+    generator, service = make_generator({'primary': monthly}, use_event_store=False)
+    events = generator.get_gcal_events(datetime.datetime(2023, 1, 1), datetime.datetime(2025, 1, 1))
+    assert next(events).id == '2023-01'
+    # Only the windows up to WINDOW_FETCH_WORKERS ahead of the one being read have been requested
+    assert '2024-12-01T00:00:00Z' not in [request['timeMin'] for request in service.requests]
+    assert [item.id for item in events] == [item['id'] for item in monthly[1:]]
+    assert '2024-12-01T00:00:00Z' in [request['timeMin'] for request in service.requests]
+
+
+def test_negative_window_days_are_rejected(workdir, monkeypatch, capsys):
+    monkeypatch.setattr('sys.argv', ['TimeSheeter.py', '--no-cache', '-wd', '-1'])
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 2
+    assert "--window-days must be 0 or more" in capsys.readouterr().err
@@ -0,0 +1,45 @@
+import datetime
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from calendar_service import EVENT_LIST_FIELDS
+from conftest import event
+
+START = datetime.datetime(2024, 3, 1)
+END = datetime.datetime(2024, 3, 31, 23, 59, 59)
+
+EVENTS = [
+    event('e1', '2024-03-04T09:00:00+01:00', '2024-03-04T10:30:00+01:00', '@acme standup'),
+    event('e2', '2024-03-05', '2024-03-06', '@foo on site'),
+    event('e3', '2024-03-06T14:00:00+01:00', '2024-03-06T15:00:00+01:00', 'untagged'),
+]
+
+
+def event_tuples(events):
+    return [(item.id, item.start, item.end, item.summary, item.all_day) for item in events]
+
+
+def test_store_sync_and_no_cache_fetch_get_every_field_they_read(make_generator):
+    # make_generator's fake rejects list calls whose mask leaves out a field the project reads
+    stored, service = make_generator({'primary': EVENTS})
+    from_store = event_tuples(stored.get_gcal_events(START, END))
+    fetched = event_tuples(make_generator({'primary': EVENTS}, use_event_store=False)[0].get_gcal_events(START, END))
+
+    assert from_store == fetched
+    assert [summary for _, _, _, summary, _ in fetched] == ['@acme standup', '@foo on site', 'untagged']
+    assert all(request['fields'] == EVENT_LIST_FIELDS for request in service.requests)
+
+
+@pytest.mark.parametrize('fields, missing', [
+    (None, 'fields mask required'),
+    ('nextPageToken,nextSyncToken,items(id,status,start,end)', 'items/summary'),
+    ('nextPageToken,nextSyncToken,items(id,status,summary,start/dateTime,end)', 'items/start'),
+    ('nextSyncToken,items', 'nextPageToken'),
+])
+def test_fake_rejects_masks_leaving_out_fields(make_generator, fields, missing):
+    _, service = make_generator({'primary': EVENTS})
+    with pytest.raises(HttpError) as error:
+        service.events().list(calendarId='primary', fields=fields).execute()
+    assert error.value.resp.status == 400
+    assert missing in error.value.content.decode()
@@ -0,0 +1,83 @@
+"""Invoice PDFs of the batch CLI (generate_invoices) and the web app's jobs, both made by render_invoices."""
+import datetime
+import json
+
+import pytest
+
+from conftest import event
+from jobs import Job
+from TimeSheeter import INVOICE_STAGES
+
+START = datetime.datetime(2024, 3, 1)
+END = datetime.datetime(2024, 3, 31, 23, 59, 59)
+
+EVENTS = [
+    event('standup', '2024-03-04T09:00:00+01:00', '2024-03-04T11:00:00+01:00', '@acme standup'),
+    event('review', '2024-03-05T09:00:00+01:00', '2024-03-05T10:30:00+01:00', '@foo review'),
+    event('lunch', '2024-03-05T12:00:00+01:00', '2024-03-05T13:00:00+01:00', 'lunch'),
+]
+
+
+@pytest.fixture
+def rendered(workdir, monkeypatch):
+    """Stand-in invoice.html and timesheet_pdf.html, and a PDF renderer recording the HTML it gets."""
+    (workdir / 'templates').mkdir()
+    (workdir / 'templates' / 'invoice.html').write_text("{{ items[0].quantity }} at {{ items[0].price }}")
+    (workdir / 'templates' / 'timesheet_pdf.html').write_text(
+        "{{ client_name }}: {% for row in timesheet_rows %}{{ row | join(' ') }}; {% endfor %}")
+    html = []
+
+    def render_client_pdfs(jobs, paths=None, progress=None):
+        html.extend(jobs)
+        for path in paths:
+            with open(path, 'wb') as f:
+                f.write(b'%PDF')
+        return list(paths)
+
+    monkeypatch.setattr('pdf_render.render_client_pdfs', render_client_pdfs)
+    return html
+
+
+@pytest.mark.parametrize('use_event_store', [True, False], ids=['store', 'no-cache'])
+def test_batch_invoices_write_pdfs_and_a_manifest_without_printing(make_generator, rendered, capsys,
+                                                                  use_event_store):
+    generator, _ = make_generator({'primary': EVENTS}, use_event_store=use_event_store)
+
+    manifest = generator.generate_invoices(START, END, 'out', invoice_date=datetime.date(2024, 4, 1))
+    assert capsys.readouterr().out == ''
+    assert [(invoice['client'], invoice['hours'], invoice['file']) for invoice in manifest['invoices']] == [
+        ('Acme', 2.0, 'invoice_Acme_20240301-20240331.pdf'),
+        ('Foo', 1.5, 'invoice_Foo_20240301-20240331.pdf'),
+    ]
+    with open('out/manifest.json', encoding='utf-8') as f:
+        assert json.load(f) == manifest
+    assert rendered == [('2.00 hours at 95,00', 'Acme: 04-03-2024 02:00 standup; '),
+                        ('1.50 hours at 80,00', 'Foo: 05-03-2024 01:30 review; ')]
+
+
+def test_web_job_renders_the_batch_invoices(make_generator, rendered, monkeypatch):
+    import jinja2
+    # Imported here: app loads clients.yaml from the current directory on import
+    import app
+
+    generator, _ = make_generator({'primary': EVENTS})
+    generator.generate_invoices(START, END, 'out', invoice_date=datetime.date(2024, 4, 1))
+    batch = list(rendered)
+    rendered.clear()
+
+    monkeypatch.setattr(app, 'TimesheetGenerator', lambda: generator)
+    monkeypatch.setattr(app.subprocess, 'run', lambda *args, **kwargs: None)
+    # The stand-in templates, through Flask's render_template
+    monkeypatch.setattr(app.app, 'jinja_loader', jinja2.FileSystemLoader('templates'))
+    job = Job(INVOICE_STAGES)
+    result = app.generate_invoices(job, {
+        'start_date': START, 'end_date': END, 'selected_clients': None, 'week_totals': False,
+        'append_timesheet': True, 'selected_columns': [], 'invoice_number': '00000000000',
+        'invoice_date': datetime.date(2024, 4, 1)})
+
+    assert result['errors'] == []
+    assert [(sheet['client_name'], sheet['total_hours']) for sheet in result['timesheets']] == [
+        ('Acme', '2 hours and 0 minutes'), ('Foo', '1 hours and 30 minutes')]
+    # The form selected no columns, so the time sheet pages show all of them
+    assert [invoice for invoice, _ in rendered] == [invoice for invoice, _ in batch]
+    assert all(stage['state'] == 'done' for stage in job.to_dict()['stages'].values())
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from TimeSheeter import Prefetcher
+
+
+def request_pages(fetch_page):
+    page_token = None
+    while True:
+        page = fetch_page(page_token)
+        yield page
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def test_pages_are_yielded_in_order():
+    def fetch_page(page_token):
+        page = int(page_token or 0)
+        return {'items': [page], **({'nextPageToken': str(page + 1)} if page < 4 else {})}
+
+    with Prefetcher(buffer_size=1) as prefetcher:
+        pages = prefetcher.add(request_pages(fetch_page))
+        assert [page['items'] for page in pages] == [[0], [1], [2], [3], [4]]
+
+
+def test_fetch_errors_reach_the_consumer():
+    def fetch_page(page_token):
+        if page_token:
+            raise RuntimeError("page 2 failed")
+        return {'items': [], 'nextPageToken': '1'}
+
+    with Prefetcher() as prefetcher:
+        pages = prefetcher.add(request_pages(fetch_page))
+        next(pages)
+        with pytest.raises(RuntimeError, match="page 2 failed"):
+            next(pages)
+
+
+def test_stopping_early_waits_for_the_request_in_progress():
+    fetching = threading.Event()
+    release = threading.Event()
+    finished = []
+
+    def fetch_page(page_token):
+        if page_token is None:
+            return {'items': [], 'nextPageToken': '1'}
+        fetching.set()
+        release.wait(5)
+        finished.append(page_token)
+        return {'items': []}
+
+    with Prefetcher(buffer_size=1) as prefetcher:
+        pages = prefetcher.add(request_pages(fetch_page))
+        next(pages)
+        assert fetching.wait(5)
+        threading.Timer(0.2, release.set).start()
+    # The service used by fetch_page is only returned to the pool once its request is done
+    assert finished == ['1']
+
+
+def test_streams_are_read_at_most_ahead_of_the_consumer():
+    started = []
+
+    def stream(index):
+        started.append(index)
+        yield index
+
+    with Prefetcher(ahead=2) as prefetcher:
+        streams = [prefetcher.add(stream(index)) for index in range(4)]
+        assert list(streams[0]) == [0]
+        for thread in prefetcher.threads:
+            thread.join(5)
+        # The third stream starts once the first has been consumed, the fourth waits for the second
+        assert sorted(started) == [0, 1, 2]
+        assert [item for stream_items in streams[1:] for item in stream_items] == [1, 2, 3]
@@ -0,0 +1,115 @@
+"""The rollup index behind TimesheetGenerator.client_totals (TOTAL output and invoices) against the time sheets."""
+import datetime
+import random
+import threading
+import time
+
+import pytest
+
+from conftest import event
+from fake_calendar import FakeServicePool
+from TimeSheeter import OutputFormat, TimesheetGenerator
+
+START = datetime.datetime(2024, 1, 1)
+END = datetime.datetime(2024, 4, 30, 23, 59, 59)
+
+SHARED = event('shared', '2024-03-04T09:00:00+01:00', '2024-03-04T11:00:00+01:00', '@acme standup')
+OWN = event('own', '2024-03-05T09:00:00+01:00', '2024-03-05T10:00:00+01:00', '@acme review')
+
+
+def sheet_totals(generator, start, end, clients=None):
+    """Client totals of the time sheets, which are built from the merged event stream."""
+    sheets = generator.build_plain_timesheets(generator.get_gcal_events(start, end), selected_clients=clients)
+    return [(sheet.client_name, sheet.total_duration) for sheet in sheets]
+
+
+def rollup_totals(generator, start, end, clients=None):
+    return [(totals.client_name, totals.total_duration) for totals in generator.client_totals(start, end, clients)]
+
+
+@pytest.mark.parametrize('use_event_store', [True, False], ids=['store', 'no-cache'])
+def test_event_in_two_calendars_is_counted_once(make_generator, capsys, use_event_store):
+    generator, _ = make_generator({'calA': [SHARED, OWN], 'calB': [SHARED]}, use_event_store=use_event_store)
+
+    generator.generate_timesheet(START, END, output_format=OutputFormat.TOTAL)
+    assert capsys.readouterr().out == "3.00\n"
+    # Invoices bill the client_totals hours
+    assert rollup_totals(generator, START, END) == [('Acme', datetime.timedelta(hours=3))]
+
+    generator.generate_timesheet(START, END, output_format=OutputFormat.CSV)
+    assert capsys.readouterr().out.splitlines()[1:3] == [
+        '04-03-2024,02:00,04,09:00,11:00,02:00,10,,02:00,standup',
+        '05-03-2024,01:00,05,09:00,10:00,01:00,10,,03:00,review',
+    ]
+
+
+def random_events(rnd, count):
+    summaries = ['@acme work', '@foo work', '@globex work', '@acme @foo joint', 'untagged']
+    events = []
+    for index in range(count):
+        start = START + datetime.timedelta(minutes=15 * rnd.randrange(4 * 24 * 110))
+        end = start + datetime.timedelta(minutes=15 * rnd.randrange(1, 40))
+        events.append(event(f'e{index:03d}', start.isoformat() + '+01:00', end.isoformat() + '+01:00',
+                            rnd.choice(summaries)))
+    return events
+
+
+def test_rollup_matches_time_sheets_of_shared_calendars(make_generator):
+    rnd = random.Random(19)
+    events = random_events(rnd, 300)
+    calendar_a = [item for index, item in enumerate(events) if index % 5 != 0]
+    calendar_b = [item for index, item in enumerate(events) if index % 5 in (0, 1)]
+    generator, service = make_generator({'calA': calendar_a, 'calB': calendar_b})
+
+    def check(rounds):
+        for _ in range(rounds):
+            start = START + datetime.timedelta(hours=rnd.randrange(24 * 100), minutes=rnd.choice([0, 20]))
+            end = start + datetime.timedelta(hours=rnd.randrange(1, 24 * 40))
+            clients = rnd.choice([None, ['Foo', 'Globex']])
+            assert rollup_totals(generator, start, end, clients) == sheet_totals(generator, start, end, clients)
+
+    check(40)
+    # Move, retag and delete events in one calendar only, some of them shared with the other
+    for item in rnd.sample(calendar_b, 15):
+        changed = dict(item, summary='@globex moved')
+        start = datetime.datetime.fromisoformat(item['start']['dateTime']) + datetime.timedelta(days=rnd.randrange(-5, 5))
+        changed['start'] = {'dateTime': start.isoformat()}
+        changed['end'] = {'dateTime': (start + datetime.timedelta(hours=1)).isoformat()}
+        service.put_event('calA', changed)
+    for item in rnd.sample(calendar_b, 5):
+        service.delete_event('calB', item['id'])
+    check(40)
+
+
+def test_sync_of_another_store_during_a_rollup_is_not_lost(make_generator):
+    # The web app runs each job with its own generator, so its own connection to events.db
+    generator, service = make_generator({'calA': [SHARED, OWN]})
+    generator.sync_calendar('calA', 'GMT+01:00')
+    other = TimesheetGenerator(service_pool=FakeServicePool(service))
+
+    reading = threading.Event()
+    proceed = threading.Event()
+    get_events_starting = generator.event_store.get_events_starting
+
+    def paused_get_events_starting(*args):
+        rows = get_events_starting(*args)
+        reading.set()
+        proceed.wait(5)
+        return rows
+
+    generator.event_store.get_events_starting = paused_get_events_starting
+    rollup = threading.Thread(target=rollup_totals, args=(generator, START, END))
+    rollup.start()
+    assert reading.wait(5)
+    # Moves the event out of the range while the rollup has read it but not saved its day yet
+    service.put_event('calA', dict(OWN, start={'dateTime': '2024-06-05T09:00:00+01:00'},
+                                   end={'dateTime': '2024-06-05T10:00:00+01:00'}))
+    sync = threading.Thread(target=other.sync_calendar, args=('calA', 'GMT+01:00'))
+    sync.start()
+    time.sleep(0.3)
+    proceed.set()
+    rollup.join(10)
+    sync.join(10)
+
+    generator.event_store.get_events_starting = get_events_starting
+    assert rollup_totals(generator, START, END) == [('Acme', datetime.timedelta(hours=2))]
@@ -0,0 +1,49 @@
+"""Locks the time sheet output (rows, Day_total, Week_total, Week_duration) to that of the original implementation.
+
+The expected files in tests/data were produced by the add_totals_to_sheet of the first version of
+TimeSheeter.py from the same events, including its quirks: Day_total is keyed by week number and day
+of the month, and Week_total and the running Week_duration by week number alone, so a week number
+that repeats in another year is counted together with the earlier one.
+"""
+import datetime
+import pathlib
+
+import pytest
+
+from conftest import event
+from TimeSheeter import OutputFormat
+
+DATA = pathlib.Path(__file__).parent / 'data'
+
+START = datetime.datetime(2023, 1, 1)
+END = datetime.datetime(2025, 12, 31, 23, 59, 59)
+
+EVENTS = [
+    event('a1', '2023-03-06T09:00:00+01:00', '2023-03-06T12:30:00+01:00', '@acme design review'),
+    event('f1', '2023-03-06T08:00:00+01:00', '2023-03-06T09:00:00+01:00', '@foo standup'),
+    event('a2', '2023-03-06T13:00:00+01:00', '2023-03-06T17:15:00+01:00', '@acme: design review'),
+    event('a3', '2023-03-08', '2023-03-09', '@acme on site'),
+    event('u1', '2023-03-09T10:00:00+01:00', '2023-03-09T11:00:00+01:00', 'lunch, untagged'),
+    event('a4', '2023-03-13T22:30:00+01:00', '2023-03-14T01:00:00+01:00', '@acme night release'),
+    # Week 10 again, a year later: same Week_nr and, on the 6th, the same Day as a1 and a2
+    event('f2', '2024-03-05T08:00:00+01:00', '2024-03-05T09:30:00+01:00', '@foo standup'),
+    event('a5', '2024-03-06T10:00:00+01:00', '2024-03-06T11:45:00+01:00', '@acme planning'),
+    event('a6', '2024-03-07', '2024-03-09', '@acme workshop'),
+    # ISO week 1 of 2025 starts in December 2024
+    event('a7', '2024-12-30T09:00:00+01:00', '2024-12-30T10:00:00+01:00', '@acme year end'),
+    event('f3', '2024-12-31T14:00:00+01:00', '2024-12-31T14:20:00+01:00', '@foo wrap up'),
+    event('a8', '2025-01-02T09:00:00+01:00', '2025-01-02T11:00:00+01:00', '@acme new year'),
+]
+
+
+@pytest.mark.parametrize('use_event_store', [True, False], ids=['store', 'no-cache'])
+@pytest.mark.parametrize('week_totals', [False, True], ids=['', 'week-totals'])
+@pytest.mark.parametrize('output_format', [OutputFormat.CSV, OutputFormat.TABLE])
+def test_output_matches_original(make_generator, capsys, output_format, week_totals, use_event_store):
+    generator, _ = make_generator({'primary': EVENTS}, use_event_store=use_event_store)
+    generator.generate_timesheet(START, END, week_totals, output_format)
+
+    suffix = '_week_totals' if week_totals else ''
+    expected = (DATA / f'totals_{output_format}{suffix}.txt').read_text(encoding='utf-8')
+    # CSV lines end with os.linesep; only the line endings may differ between platforms
+    assert capsys.readouterr().out.replace('\r\n', '\n') == expected
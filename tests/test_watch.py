@@ -0,0 +1,126 @@
+"""Watch mode: the time sheets IncrementalSheets patches from synced changes against a full rebuild."""
+import datetime
+
+from conftest import event
+from TimeSheeter import IncrementalSheets, TagRouter
+
+START = datetime.datetime(2024, 1, 1)
+END = datetime.datetime(2024, 4, 30, 23, 59, 59)
+# Two year ends, with the days of ISO week 1 of 2025 in both years
+YEARS_START = datetime.datetime(2023, 12, 1)
+YEARS_END = datetime.datetime(2025, 1, 31, 23, 59, 59)
+TIME_ZONE = 'GMT+01:00'
+
+SHARED = event('shared', '2024-03-04T09:00:00+01:00', '2024-03-04T11:00:00+01:00', '@acme standup')
+OWN = event('own', '2024-03-05T09:00:00+01:00', '2024-03-05T10:00:00+01:00', '@acme review')
+OTHER = event('other', '2024-03-12T14:00:00+01:00', '2024-03-12T15:30:00+01:00', '@foo planning')
+
+
+def rebuilt(generator, start=START, end=END):
+    """Rows and totals of the time sheets built from the merged event stream."""
+    sheets = generator.build_plain_timesheets(generator.get_gcal_events(start, end), week_totals=True)
+    return [(sheet.client_name, sheet.total_duration, sheet.rows) for sheet in sheets]
+
+
+def patched(sheets):
+    return [(sheet.client_name, sheet.total_duration, sheet.rows) for sheet in sheets.sheets()]
+
+
+def load(generator, start=START, end=END):
+    router = TagRouter(generator.client_config.aliases, generator.client_list)
+    sheets = IncrementalSheets(router, start, end, week_totals=True)
+    for cal_index, cal_id in enumerate(generator.get_calendar_ids()):
+        generator.sync_calendar(cal_id, TIME_ZONE)
+        sheets.apply(cal_index, generator.event_store.get_events(cal_id, start, end))
+    return sheets
+
+
+def poll(generator, sheets):
+    """Sync every calendar and apply its changes, as one poll of watch_timesheet does."""
+    changed = set()
+    for cal_index, cal_id in enumerate(generator.get_calendar_ids()):
+        changes = []
+        generator.sync_calendar(cal_id, TIME_ZONE, changes)
+        changed |= sheets.apply(cal_index, changes)
+    return sorted(changed)
+
+
+def moved(item, days):
+    start = datetime.datetime.fromisoformat(item['start']['dateTime']) + datetime.timedelta(days=days)
+    end = datetime.datetime.fromisoformat(item['end']['dateTime']) + datetime.timedelta(days=days)
+    return dict(item, start={'dateTime': start.isoformat()}, end={'dateTime': end.isoformat()})
+
+
+def test_watch_shows_an_event_of_two_calendars_once(make_generator, capsys):
+    generator, _ = make_generator({'calA': [SHARED, OWN], 'calB': [SHARED]})
+
+    generator.watch_timesheet(START, END, polls=0)
+    out = capsys.readouterr().out
+    assert out.count('standup') == 1
+    assert "Total duration for client was: 3 hours and 0 minutes." in out
+
+
+def test_patched_sheets_match_a_rebuild(make_generator):
+    generator, service = make_generator({'calA': [SHARED, OWN, OTHER], 'calB': [SHARED]})
+    sheets = load(generator)
+    assert patched(sheets) == rebuilt(generator)
+
+    # Move an event to the next week
+    service.put_event('calA', moved(OWN, 7))
+    assert poll(generator, sheets) == [('Acme', '10'), ('Acme', '11')]
+    assert patched(sheets) == rebuilt(generator)
+
+    # Retag an event to another client
+    service.put_event('calA', dict(OTHER, summary='@globex planning'))
+    assert poll(generator, sheets) == [('Foo', '11'), ('Globex', '11')]
+    assert patched(sheets) == rebuilt(generator)
+
+    # Retag the shared event in the first calendar only: its version is the one shown
+    service.put_event('calA', dict(SHARED, summary='@foo standup'))
+    assert poll(generator, sheets) == [('Acme', '10'), ('Foo', '10')]
+    assert patched(sheets) == rebuilt(generator)
+
+    # Delete it there: the second calendar's version is shown again
+    service.delete_event('calA', 'shared')
+    assert poll(generator, sheets) == [('Acme', '10'), ('Foo', '10')]
+    assert patched(sheets) == rebuilt(generator)
+
+    # Move it in the second calendar and add it to the first again
+    service.put_event('calB', moved(SHARED, 1))
+    service.put_event('calA', moved(SHARED, 1))
+    assert poll(generator, sheets) == [('Acme', '10')]
+    assert patched(sheets) == rebuilt(generator)
+    assert [row[-1] for row in sheets.sheets()[0].rows].count('standup') == 1
+
+
+def test_patched_sheets_match_a_rebuild_across_years(make_generator):
+    # The time sheets total per Week_nr without the year: week 1 of 2024 and of 2025 share totals,
+    # and a run of rows continues across the year when no other week comes between
+    acme = [event('a1', '2023-12-27T09:00:00+01:00', '2023-12-27T10:00:00+01:00', '@acme a1'),
+            event('a2', '2024-01-02T09:00:00+01:00', '2024-01-02T11:00:00+01:00', '@acme a2'),
+            event('a3', '2024-12-23T09:00:00+01:00', '2024-12-23T10:30:00+01:00', '@acme a3'),
+            event('a4', '2024-12-31T09:00:00+01:00', '2024-12-31T10:00:00+01:00', '@acme a4'),
+            event('a5', '2025-01-02T09:00:00+01:00', '2025-01-02T12:00:00+01:00', '@acme a5')]
+    foo = [event('f1', '2024-01-03T09:00:00+01:00', '2024-01-03T10:00:00+01:00', '@foo f1'),
+           event('f2', '2025-01-01T09:00:00+01:00', '2025-01-01T10:30:00+01:00', '@foo f2')]
+    generator, service = make_generator({'calA': acme + foo})
+    sheets = load(generator, YEARS_START, YEARS_END)
+    assert patched(sheets) == rebuilt(generator, YEARS_START, YEARS_END)
+
+    # Without the week 52 event in between, the week 1 rows of both years make one run
+    service.delete_event('calA', 'a3')
+    assert poll(generator, sheets) == [('Acme', '01'), ('Acme', '52')]
+    assert patched(sheets) == rebuilt(generator, YEARS_START, YEARS_END)
+
+    # An event of another week between Foo's week 1 rows splits their run
+    service.put_event('calA', event('f3', '2024-06-04T09:00:00+01:00', '2024-06-04T10:00:00+01:00', '@foo f3'))
+    assert poll(generator, sheets) == [('Foo', '01'), ('Foo', '23')]
+    assert patched(sheets) == rebuilt(generator, YEARS_START, YEARS_END)
+
+    # Move the first event of 2025 into week 52 of 2024, and back into week 1
+    service.put_event('calA', moved(acme[3], -7))
+    assert poll(generator, sheets) == [('Acme', '01'), ('Acme', '52')]
+    assert patched(sheets) == rebuilt(generator, YEARS_START, YEARS_END)
+    service.put_event('calA', acme[3])
+    assert poll(generator, sheets) == [('Acme', '01'), ('Acme', '52')]
+    assert patched(sheets) == rebuilt(generator, YEARS_START, YEARS_END)